@@ -0,0 +1,68 @@
+"""
+Benchmark of apply_BERT_model on CPU: fixed row batches in arrival order vs. length-bucketed batches
+under a token budget. Uses a small randomly initialised BERT, so only the throughput is meaningful.
+
+Usage: python -m benchmarks.bert_batching [num_rows] [max_tokens]
+"""
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+
+import pandas as pd
+from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+import src.model.bert_prediction as bp
+
+
+def tiny_model_and_tokenizer(vocab_size=2000, seed=0):
+    """
+    Builds a small random-weight BERT classifier and a tokenizer with a synthetic word vocabulary
+    returns: model, tokenizer, vocabulary words
+    """
+    rnd = random.Random(seed)
+    words = sorted({''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 8))) for _ in range(vocab_size)})
+    vocab_dir = tempfile.mkdtemp()
+    with open(os.path.join(vocab_dir, 'vocab.txt'), 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + words))
+    tokenizer = BertTokenizerFast(os.path.join(vocab_dir, 'vocab.txt'))
+    config = BertConfig(vocab_size=tokenizer.vocab_size, hidden_size=128, num_hidden_layers=2,
+                        num_attention_heads=2, intermediate_size=256, num_labels=len(bp.LABEL_MAP))
+    model = BertForSequenceClassification(config).to(bp.device).eval()
+    return model, tokenizer, words
+
+
+def synthetic_inputs(words, num_rows, seed=1):
+    """
+    Mix of short and long inputs, similar to sentence + keyword pair inputs of run.py
+    returns: pandas.DataFrame with the 'input_data_bert' column
+    """
+    rnd = random.Random(seed)
+    texts = [' '.join(rnd.choices(words, k=rnd.choice([rnd.randint(5, 20), rnd.randint(60, 150)])))
+             for _ in range(num_rows)]
+    return pd.DataFrame({'input_data_bert': texts})
+
+
+def main(num_rows=4096, max_tokens=16384):
+    model, tokenizer, words = tiny_model_and_tokenizer()
+    df = synthetic_inputs(words, num_rows)
+    real_tokens = sum(len(ids) for ids in tokenizer(df['input_data_bert'].tolist(),
+                                                    truncation=True, max_length=128)['input_ids'])
+    runs = (('fixed 1024 rows', dict(batch_size=1024)),
+            (f'bucketed {max_tokens} tokens', dict(batch_size=1024, max_tokens=max_tokens)))
+    predictions = []
+    for name, kwargs in runs:
+        start = time.perf_counter()
+        result = bp.apply_BERT_model(df=df.copy(), input_col='input_data_bert', pred_col='category',
+                                     model=model, tokenizer=tokenizer, **kwargs)
+        elapsed = time.perf_counter() - start
+        predictions.append(result['category'].tolist())
+        print(f'{name:>24}: {elapsed:.2f}s, {real_tokens / elapsed:.0f} tokens/s')
+    agreement = sum(a == b for a, b in zip(*predictions)) / num_rows
+    print(f'prediction agreement: {agreement:.2%}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
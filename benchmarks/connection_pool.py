@@ -0,0 +1,51 @@
+"""
+Benchmark of short database batches: a fresh psycopg2 connection per call (former run.py wrappers)
+vs. a connection borrowed from the per-process pool.
+Needs the POSTGRES_* variables of a reachable database.
+
+Usage: python -m benchmarks.connection_pool [num_calls]
+"""
+import sys
+import time
+
+import psycopg2
+from dotenv import load_dotenv
+
+from src.db.connection_pool import close_pool, connection_params, pooled_connection
+
+
+def short_batch(conn):
+    with conn.cursor() as curr:
+        curr.execute('SELECT 1')
+        curr.fetchone()
+    conn.commit()
+
+
+def bench_connect(num_calls):
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        conn = psycopg2.connect(**connection_params())
+        short_batch(conn)
+        conn.close()
+    return time.perf_counter() - start
+
+
+def bench_pool(num_calls):
+    start = time.perf_counter()
+    for _ in range(num_calls):
+        with pooled_connection() as conn:
+            short_batch(conn)
+    elapsed = time.perf_counter() - start
+    close_pool()
+    return elapsed
+
+
+def main(num_calls=200):
+    load_dotenv()
+    for name, bench in (('connect per call', bench_connect), ('pooled', bench_pool)):
+        elapsed = bench(num_calls)
+        print(f'{name:>16}: {elapsed:.3f}s, {elapsed / num_calls * 1000:.2f} ms per batch')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,45 @@
+"""
+Latency/throughput comparison of the CPU inference backends (FP32 PyTorch, int8 PyTorch, ONNX Runtime)
+and their label parity with the FP32 model. Uses the fine-tuned model from MODEL_PATH when it is set,
+otherwise a small random-weight BERT.
+
+Usage: python -m benchmarks.inference_backends [num_rows] [batch_size]
+"""
+import os
+import sys
+import tempfile
+import time
+
+from dotenv import load_dotenv
+
+import src.model.backends as mb
+import src.model.bert_prediction as bp
+from benchmarks.bert_batching import synthetic_inputs, tiny_model_and_tokenizer
+
+
+def main(num_rows=2048, batch_size=64):
+    load_dotenv()
+    model_path = os.getenv('MODEL_PATH')
+    if model_path:
+        model, tokenizer = bp.load_model_and_tokenizer(model_path, num_of_labels=len(bp.LABEL_MAP))
+        words = list(tokenizer.vocab)
+    else:
+        model, tokenizer, words = tiny_model_and_tokenizer()
+    model = model.to('cpu').eval()
+    df = synthetic_inputs(words, num_rows)
+
+    onnx_path = mb.export_onnx(model, tokenizer, os.path.join(tempfile.mkdtemp(), 'model.onnx'))
+    backends = (('pytorch', model), ('pytorch-int8', mb.quantize_model(model)),
+                ('onnx', mb.OnnxBertModel(onnx_path)))
+    for name, backend_model in backends:
+        start = time.perf_counter()
+        bp.apply_BERT_model(df=df.copy(), input_col='input_data_bert', pred_col='category',
+                            model=backend_model, tokenizer=tokenizer, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        parity = mb.accuracy_parity(df, 'input_data_bert', model, backend_model, tokenizer, batch_size=batch_size)
+        print(f'{name:>13}: {num_rows / elapsed:.0f} rows/s, '
+              f'{elapsed / -(-num_rows // batch_size) * 1000:.1f} ms per batch, label parity {parity:.2%}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
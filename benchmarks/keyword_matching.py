@@ -0,0 +1,44 @@
+"""
+Benchmark of the keyword matching step of get_relations:
+the former single regex alternation vs. the Aho-Corasick KeywordMatcher.
+
+Usage: python -m benchmarks.keyword_matching [num_keywords] [num_sentences]
+"""
+import re
+import sys
+import time
+
+from benchmarks.synthetic import synthetic_keywords, synthetic_sentences
+from src.utils.keyword_matcher import KeywordMatcher
+
+
+def bench_regex(keywords, sentences):
+    start = time.perf_counter()
+    pattern = re.compile(r'\b(' + '|'.join(re.escape(k) for k in keywords) + r')\b')
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    hits = sum(len(pattern.findall(sentence)) for sentence in sentences)
+    return build, time.perf_counter() - start, hits
+
+
+def bench_matcher(keywords, sentences):
+    start = time.perf_counter()
+    matcher = KeywordMatcher(keywords)
+    build = time.perf_counter() - start
+    start = time.perf_counter()
+    hits = sum(len(matcher.find(sentence)) for sentence in sentences)
+    return build, time.perf_counter() - start, hits
+
+
+def main(num_keywords=20000, num_sentences=5000):
+    keywords = synthetic_keywords(num_keywords)
+    sentences = synthetic_sentences(keywords, num_sentences)
+    print(f'keywords: {num_keywords}, sentences: {num_sentences}')
+    for name, bench in (('regex', bench_regex), ('aho-corasick', bench_matcher)):
+        build, scan, hits = bench(keywords, sentences)
+        print(f'{name:>13}: build {build:.3f}s, scan {scan:.3f}s '
+              f'({num_sentences / scan:.0f} sentences/s), hits {hits}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
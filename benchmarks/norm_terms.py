@@ -0,0 +1,73 @@
+"""
+Benchmark of the keyword term lookup of run_analyzer on a large relation frame: the two pd.merge calls of
+adding_norm_terms followed by the filter of the relations between keywords with the same normalized term, against
+adding_norm_terms_indexed with a KeywordIndex. The term columns of both are compared before the timings and the
+memory of the term columns are printed.
+
+Usage: python -m benchmarks.norm_terms [num_rows] [num_keywords]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import src.db.input_preparation as ip
+import src.utils.text_postprocessing as po
+from benchmarks.synthetic import keywords_table, synthetic_keywords
+
+TERM_COLUMNS = [f'{col}_{side}' for col in po.TERM_COLS for side in 'xy']
+
+
+def synthetic_pairs(df_kwords, num_rows, seed=0):
+    """
+    Relations shaped like the output of get_relations, with keyword pairs drawn from the keyword table
+    returns: pandas DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    names = df_kwords['name'].to_numpy(dtype=object)
+    return pd.DataFrame({'paper': pd.Series([f'paper_{i}.txt' for i in rng.integers(0, 1000, num_rows)]),
+                         '1st_keyword': names[rng.integers(0, len(names), num_rows)],
+                         '2nd_keyword': names[rng.integers(0, len(names), num_rows)],
+                         'sentences': pd.Series([f'sentence {i}' for i in rng.integers(0, num_rows // 4 + 1,
+                                                                                        num_rows)])})
+
+
+def merged_terms(df, df_kwords):
+    df_paper = po.adding_norm_terms(df=df, df_kwords=df_kwords)
+    return df_paper[df_paper['normalized_term_x'] != df_paper['normalized_term_y']]
+
+
+def _best_of(func, runs=3):
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = func()
+        times.append(time.perf_counter() - start)
+    return result, min(times)
+
+
+def main(num_rows=1_000_000, num_keywords=20_000):
+    df_kwords = ip.clean_keywords(df=keywords_table(synthetic_keywords(num_keywords)), col='name')
+    df = synthetic_pairs(df_kwords, num_rows)
+
+    merged, merged_time = _best_of(lambda: merged_terms(df, df_kwords))
+    keyword_index, index_time = _best_of(lambda: po.KeywordIndex(df_kwords))
+    indexed, indexed_time = _best_of(lambda: po.adding_norm_terms_indexed(df=df, keyword_index=keyword_index))
+
+    assert len(merged) == len(indexed), 'both have to keep the same relations'
+    for col in TERM_COLUMNS:
+        assert merged[col].astype(object).reset_index(drop=True).equals(
+            indexed[col].astype(object).reset_index(drop=True)), col
+
+    def term_memory(frame):
+        return frame[TERM_COLUMNS].memory_usage(deep=True, index=False).sum() / 2 ** 20
+
+    print(f'{num_rows} relations, {num_keywords} keywords, {len(indexed)} kept')
+    print(f'{"merge + filter":>16}: {merged_time:7.3f}s, term columns {term_memory(merged):8.1f} MiB')
+    print(f'{"indexed":>16}: {indexed_time:7.3f}s, term columns {term_memory(indexed):8.1f} MiB '
+          f'({merged_time / indexed_time:.1f}x faster, KeywordIndex built once in {index_time:.3f}s)')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,104 @@
+"""
+Benchmark of the result preparation steps on large relation frames:
+the former DataFrame.append / per-group lambdas vs. pd.concat and the vectorized merge_abbreviations.
+The outputs of both versions are compared before the timings are printed.
+
+Usage: python -m benchmarks.result_preparation [num_rows] [num_papers]
+"""
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import src.utils.result_preparation as rp
+
+MERGE_COLS = rp.MERGE_KEYS + ['1st_keyword', '2nd_keyword', 'sentences', 'category', 'general_term_x',
+                              'general_term_y']
+
+
+def legacy_swap_and_add(df):
+    df2 = df.copy()
+    for a, b in [('1st_keyword', '2nd_keyword'), ('normalized_term_x', 'normalized_term_y'),
+                 ('general_term_x', 'general_term_y'), ('displayed_term_x', 'displayed_term_y')]:
+        df2[a] = df[b]
+        df2[b] = df[a]
+    return pd.concat([df, df2], ignore_index=True)
+
+
+def legacy_merge_abbreviations(df, cols):
+    return df[cols].groupby(rp.MERGE_KEYS, as_index=False).agg(
+        {'1st_keyword': lambda x: ', '.join(sorted(set(x), key=len, reverse=True)),
+         '2nd_keyword': lambda x: ', '.join(sorted(set(x), key=len, reverse=True)),
+         'sentences': lambda x: (x.unique().tolist()),
+         'category': lambda x: (x.unique().tolist()),
+         'general_term_x': lambda x: (x.unique().tolist()),
+         'general_term_y': lambda x: (x.unique().tolist())})
+
+
+def synthetic_relations(num_rows, num_papers, seed=0):
+    """
+    Relation frame shaped like the output of adding_norm_terms, with several keywords (abbreviations)
+    per normalized term
+    returns: pandas DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    num_terms = max(num_rows // 50, 10)
+    term_x, term_y = rng.integers(0, num_terms, num_rows), rng.integers(0, num_terms, num_rows)
+    variant_x, variant_y = rng.integers(0, 3, num_rows), rng.integers(0, 3, num_rows)
+
+    def keyword(term, variant):
+        return pd.Series(['t' * (v + 1) + str(t) for t, v in zip(term, variant)], dtype=object)
+
+    return pd.DataFrame({'paper': pd.Series([f'paper_{i}.txt' for i in rng.integers(0, num_papers, num_rows)],
+                                            dtype=object),
+                         '1st_keyword': keyword(term_x, variant_x), '2nd_keyword': keyword(term_y, variant_y),
+                         'sentences': pd.Series([f'sentence {i}' for i in rng.integers(0, num_rows // 4 + 1, num_rows)],
+                                                dtype=object),
+                         'category': pd.Series(np.asarray(['positive', 'negative', 'neutral'], dtype=object)
+                                               [rng.integers(0, 3, num_rows)], dtype=object),
+                         'normalized_term_x': pd.Series([f'term {t}' for t in term_x], dtype=object),
+                         'normalized_term_y': pd.Series([f'term {t}' for t in term_y], dtype=object),
+                         'general_term_x': pd.Series([f'general {t % 7}' for t in term_x], dtype=object),
+                         'general_term_y': pd.Series([f'general {t % 7}' for t in term_y], dtype=object),
+                         'displayed_term_x': pd.Series([f'Term {t}' for t in term_x], dtype=object),
+                         'displayed_term_y': pd.Series([f'Term {t}' for t in term_y], dtype=object)})
+
+
+def _same_merge(expected, result):
+    """
+    Equal frames, except that keywords of the same length may be joined in a different order
+    (the former version took them in the iteration order of a set)
+    """
+    def normalize(df):
+        df = df.copy()
+        for col in ['1st_keyword', '2nd_keyword']:
+            df[col] = df[col].map(lambda x: sorted(x.split(', '), key=lambda k: (-len(k), k)))
+        return df
+    pd.testing.assert_frame_equal(normalize(expected), normalize(result), check_dtype=False)
+
+
+def _timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+
+def main(num_rows=1000000, num_papers=1000):
+    df = synthetic_relations(num_rows, num_papers)
+    print(f'rows: {num_rows}, papers: {num_papers}')
+
+    expected, legacy_time = _timed(lambda: legacy_swap_and_add(df))
+    result, new_time = _timed(lambda: rp.swap_and_add(df))
+    pd.testing.assert_frame_equal(expected, result)
+    print(f'       swap_and_add: legacy {legacy_time:.3f}s, concat {new_time:.3f}s')
+
+    expected, legacy_time = _timed(lambda: legacy_merge_abbreviations(result, MERGE_COLS))
+    merged, new_time = _timed(lambda: rp.merge_abbreviations(result, MERGE_COLS))
+    _same_merge(expected, merged)
+    print(f'merge_abbreviations: legacy {legacy_time:.3f}s, vectorized {new_time:.3f}s '
+          f'({legacy_time / new_time:.1f}x), groups {len(merged)}')
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,125 @@
+"""
+Benchmark of the result sinks on synthetic relation batches: the Parquet dataset of ParquetSink against insert_data
+on the SQLite stand-in of the database (once more with the sentences already stored), the CSV export of df2csv and,
+with --postgres, insert_data_bulk (once more with the sentences already stored and not cached).
+Prints the rows/s and the bytes on disk of every sink, and reads the Parquet dataset back to check the row counts.
+
+Usage: python -m benchmarks.result_sinks [--batches N] [--rows N] [--row-group N] [--postgres]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import src.db.database_create as dc
+import src.utils.parquet_sink as ps
+import src.utils.result_preparation as rp
+from benchmarks.synthetic import SQLiteStandIn, synthetic_keywords, synthetic_sentences
+
+CATEGORIES = ['POSITIVE IMPACT', 'NEGATIVE IMPACT', 'NO IMPACT', 'NO RELATION']
+
+
+def synthetic_results(num_rows, batch, seed=0):
+    """
+    Relations of one batch in the shape of the insertion stage input: every sentence holds a few keyword pairs
+    returns: pandas.DataFrame
+    """
+    rnd = np.random.default_rng(seed + batch)
+    keywords = synthetic_keywords(500)
+    sentences = synthetic_sentences(keywords, max(num_rows // 3, 1), seed=seed + batch)
+    sentence_idx = np.sort(rnd.integers(0, len(sentences), num_rows))
+    return pd.DataFrame({
+        'bib_id': batch * 1000 + sentence_idx % 10,
+        'year': rnd.choice([2018, 2019, 2020, 2021, 2022], num_rows),
+        'sentences': [sentences[i] for i in sentence_idx],
+        '1st_keyword': rnd.choice(keywords, num_rows),
+        '2nd_keyword': rnd.choice(keywords, num_rows),
+        'category': rnd.choice(CATEGORIES, num_rows),
+    })
+
+
+def _size(path):
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def _report(name, rows, seconds, path=None):
+    size = f'{_size(path) / 2 ** 20:8.2f} MiB' if path else ' ' * 12
+    print(f'{name:>18}: {seconds:8.3f}s {rows / max(seconds, 1e-9):12.1f} rows/s {size}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Parquet sink vs. database and CSV result sinks')
+    parser.add_argument('--batches', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=20000, help='relations per batch')
+    parser.add_argument('--row-group', type=int, default=ps.ROW_GROUP_SIZE)
+    parser.add_argument('--postgres', action='store_true',
+                        help='also benchmark insert_data_bulk against the POSTGRES_* database (writes rows!)')
+    args = parser.parse_args(argv)
+
+    batches = [synthetic_results(args.rows, batch) for batch in range(args.batches)]
+    rows = sum(len(df) for df in batches)
+    directory = tempfile.mkdtemp(prefix='bench_sinks_')
+
+    parquet_path = os.path.join(directory, 'parquet')
+    committed = []
+    start = time.perf_counter()
+    with ps.ParquetSink(parquet_path, row_group_size=args.row_group, on_commit=committed.extend) as sink:
+        for batch, df in enumerate(batches):
+            sink.write(df, document_ids=[batch])
+    _report('parquet', rows, time.perf_counter() - start, parquet_path)
+
+    import pyarrow.dataset as ds
+
+    relationships = ds.dataset(os.path.join(parquet_path, 'relationships'), format='parquet', partitioning='hive')
+    assert relationships.count_rows() == rows, 'every relation has to be written once'
+    assert sorted(committed) == list(range(args.batches)), 'every batch has to be committed once'
+
+    csv_path = os.path.join(directory, 'csv')
+    os.makedirs(csv_path)
+    start = time.perf_counter()
+    for batch, df in enumerate(batches):
+        rp.df2csv(df, os.path.join(csv_path, f'results-{batch}.csv'), '\t')
+    _report('df2csv', rows, time.perf_counter() - start, csv_path)
+
+    db_path = os.path.join(directory, 'results.db')
+    db = SQLiteStandIn(db_path)
+    start = time.perf_counter()
+    for df in batches:
+        dc.insert_data(df, db, schema_name='main')
+    _report('insert_data', rows, time.perf_counter() - start, db_path)
+    sentences = db.cursor().execute('SELECT COUNT(*) FROM sentences').fetchone()[0]
+    # the same batches again: every sentence is resolved from the cache of the process, none is written
+    start = time.perf_counter()
+    for df in batches:
+        dc.insert_data(df, db, schema_name='main')
+    _report('insert_data repeat', rows, time.perf_counter() - start, db_path)
+    assert db.cursor().execute('SELECT COUNT(*) FROM sentences').fetchone()[0] == sentences, \
+        'repeated sentences have to be stored once'
+    db.close()
+
+    if args.postgres:
+        import psycopg2
+        from src.db.connection_pool import connection_params
+        from src.db.sentence_dedup import sentence_id_cache
+
+        conn = psycopg2.connect(**connection_params())
+        start = time.perf_counter()
+        for df in batches:
+            dc.insert_data_bulk(df, conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
+        _report('insert_data_bulk', rows, time.perf_counter() - start)
+        # the same batches again, resolved by the database: the process cache is cleared
+        sentence_id_cache(os.getenv('POSTGRES_SCHEMA')).clear()
+        start = time.perf_counter()
+        for df in batches:
+            dc.insert_data_bulk(df, conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
+        _report('bulk repeat', rows, time.perf_counter() - start)
+        conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Startup time of run.py: the time from the start of the process until the pipeline can take its first batch.
+run.py of the given checkout is started with an empty document range (START_DOCUMENT_ID = MAX_DOCUMENT_ID = -1),
+so no batch is processed and nothing is written besides the ledger tables. The time of the STARTUP TIME line is
+reported, or the whole run for checkouts which load the model before the pipeline starts (and print no such line),
+together with MODEL LOADING TIME when it is printed.
+
+Without --model-path a random-weight model of the BERT-base size is saved to a temporary directory,
+so loading it costs the same as the real model. Runs against the POSTGRES_* database (keywords table required).
+
+Usage: python -m benchmarks.startup [--repo DIR] [--model-path DIR] [--runs N]
+"""
+import argparse
+import os
+import random
+import re
+import statistics
+import string
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def base_size_model(num_labels=4, seed=0):
+    """
+    Saves a random-weight BERT-base sized classifier and a tokenizer with a synthetic vocabulary
+    returns: model directory
+    """
+    from transformers import BertConfig, BertForSequenceClassification, BertTokenizerFast
+
+    rnd = random.Random(seed)
+    model_dir = tempfile.mkdtemp(prefix='startup_model_')
+    words = set()
+    while len(words) < 30000:
+        words.add(''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10))))
+    with open(os.path.join(model_dir, 'vocab.txt'), 'w') as f:
+        f.write('\n'.join(['[PAD]', '[UNK]', '[CLS]', '[SEP]', '[MASK]'] + sorted(words)))
+    tokenizer = BertTokenizerFast(os.path.join(model_dir, 'vocab.txt'))
+    tokenizer.save_pretrained(model_dir)
+    BertForSequenceClassification(BertConfig(vocab_size=tokenizer.vocab_size, num_labels=num_labels)) \
+        .save_pretrained(model_dir)
+    return model_dir
+
+
+def measure(repo, model_path, extra_args=()):
+    """
+    Runs run.py of the checkout once
+    returns: dict with the seconds until the pipeline starts, of the model loading and of the whole process
+    """
+    env = dict(os.environ, MODEL_PATH=model_path, START_DOCUMENT_ID='-1', MAX_DOCUMENT_ID='-1',
+               PYTHONPATH=os.path.abspath(repo))
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, 'run.py', *extra_args], cwd=repo, env=env, text=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    ready, model_loading, lines = None, None, []
+    for line in process.stdout:
+        lines.append(line)
+        if line.startswith('STARTUP TIME') and ready is None:
+            ready = time.perf_counter() - start
+        found = re.match(r'MODEL LOADING TIME:\s+([\d.]+)', line)
+        if found:
+            model_loading = float(found.group(1))
+    if process.wait():
+        raise RuntimeError(f'run.py failed:\n{"".join(lines[-20:])}')
+    total = time.perf_counter() - start
+    return {'ready': ready if ready is not None else total, 'model_loading': model_loading, 'total': total}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Startup time of run.py')
+    parser.add_argument('--repo', default='.', help='checkout whose run.py is measured')
+    parser.add_argument('--model-path', default=None)
+    parser.add_argument('--runs', type=int, default=3)
+    args, extra_args = parser.parse_known_args(argv)
+
+    model_path = args.model_path or base_size_model()
+    measure(args.repo, model_path, extra_args)  # warms the page cache and the keyword dictionary cache
+    runs = [measure(args.repo, model_path, extra_args) for _ in range(args.runs)]
+    for name in ('ready', 'model_loading', 'total'):
+        values = [run[name] for run in runs if run[name] is not None]
+        if values:
+            print(f'{name:>14}: median {statistics.median(values):7.2f}s  '
+                  f'(min {min(values):.2f}s, max {max(values):.2f}s, {len(values)} runs)')
+
+
+if __name__ == '__main__':
+    main()
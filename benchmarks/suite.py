@@ -0,0 +1,142 @@
+"""
+End-to-end benchmark suite of the pipeline steps on a synthetic corpus and a local SQLite stand-in of the database.
+The results are printed (and optionally written) as JSON, tagged with the current commit, so they can be compared
+across commits.
+
+Usage: python -m benchmarks.suite [--papers N] [--keywords N] [--bert-rows N] [--skip-bert] [--postgres]
+                                  [--output results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+from datetime import datetime
+
+import numpy as np
+
+import src.db.database_create as dc
+import src.db.input_preparation as ip
+import src.utils.keywords_detection as kd
+import src.utils.metrics as metrics
+import src.utils.text_postprocessing as po
+import src.utils.text_preprocessing as pr
+from benchmarks.norm_terms import merged_terms
+from benchmarks.synthetic import SQLiteStandIn, keywords_table, synthetic_keywords, write_corpus
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _measure(results, name, func, count):
+    """
+    Runs func once, records the wall time and the throughput of the items counted by count(result)
+    returns: result of func
+    """
+    start = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - start
+    items = count(result)
+    results.append({'name': name, 'seconds': round(seconds, 4), 'items': items,
+                    'items_per_s': round(items / seconds, 1) if seconds else None})
+    print(f'{name:>18}: {seconds:8.3f}s {items:>9} items {items / max(seconds, 1e-9):12.1f} items/s')
+    return result
+
+
+def run_suite(num_papers=200, num_keywords=5000, bert_rows=2000, skip_bert=False, postgres=False):
+    """
+    Runs all the benchmarks
+    returns: dict ready to be dumped as JSON
+    """
+    results = []
+    corpus_dir = tempfile.mkdtemp(prefix='bench_corpus_')
+    keywords = synthetic_keywords(num_keywords)
+    df_kwords = ip.clean_keywords(df=keywords_table(keywords), col='name')
+    documents = write_corpus(corpus_dir, keywords, num_papers)
+    documents['file_loc'] = [os.path.join(corpus_dir, f.replace('.bib', '.txt')) for f in documents['file_location']]
+
+    db = SQLiteStandIn()
+    db.load('keywords', df_kwords)
+    db.load('documents', documents.drop(columns=['file_loc']))
+
+    _measure(results, 'read_files', lambda: [pr.read_files(f) for f in documents['file_loc']],
+             lambda texts: sum(len(text) for text in texts))
+    _measure(results, 'get_relations_no_prefilter',
+             lambda: kd.get_relations(kword_col=df_kwords['name'], df=documents, conn=db, schema_name='main',
+                                      prefilter=False), len)
+    with metrics.scope() as relations_metrics:
+        df_paper = _measure(results, 'get_relations',
+                            lambda: kd.get_relations(kword_col=df_kwords['name'], df=documents, conn=db,
+                                                     schema_name='main'), len)
+    counters = relations_metrics.counters
+    prefilter = {'sentences': counters.get('sentences', 0),
+                 'rejected_sentences': counters.get('prefilter_rejected_sentences', 0),
+                 'rejected_documents': counters.get('prefilter_rejected_documents', 0),
+                 'speedup': round(results[-2]['seconds'] / max(results[-1]['seconds'], 1e-9), 2)}
+    print(f"{'prefilter':>18}: {prefilter}")
+    # the merges and the self-relation filter they were followed by in run_analyzer
+    _measure(results, 'adding_norm_terms', lambda: merged_terms(df_paper, df_kwords), len)
+    keyword_index = po.KeywordIndex(df_kwords)
+    df_paper = _measure(results, 'norm_terms_indexed',
+                        lambda: po.adding_norm_terms_indexed(df=df_paper, keyword_index=keyword_index), len)
+    df_paper = df_paper.reset_index(drop=True)
+    df_paper['category'] = np.nan
+
+    if not skip_bert:
+        import src.model.bert_prediction as bp
+        from benchmarks.bert_batching import tiny_model_and_tokenizer
+        from src.utils.bert_inputs import bert_input_texts
+
+        model, tokenizer, _ = tiny_model_and_tokenizer()
+        df_bert = df_paper.head(bert_rows).copy()
+        df_bert['input_data_bert'] = bert_input_texts(df_bert)
+        _measure(results, 'apply_BERT_model',
+                 lambda: bp.apply_BERT_model(df=df_bert, input_col='input_data_bert', pred_col='category',
+                                             model=model, tokenizer=tokenizer, batch_size=1024), len)
+
+    _measure(results, 'insert_data', lambda: dc.insert_data(df_paper, db, schema_name='main'), lambda counter: counter)
+    db.close()
+
+    if postgres:
+        import psycopg2
+        from src.db.connection_pool import connection_params
+
+        conn = psycopg2.connect(**connection_params())
+        _measure(results, 'insert_data_bulk',
+                 lambda: dc.insert_data_bulk(df_paper, conn, schema_name=os.getenv('POSTGRES_SCHEMA')),
+                 lambda counter: counter)
+        conn.close()
+
+    return {'commit': _commit(), 'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'cpu_count': os.cpu_count(),
+            'params': {'papers': num_papers, 'keywords': num_keywords, 'bert_rows': bert_rows},
+            'prefilter': prefilter, 'results': results}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the pipeline steps on a synthetic corpus')
+    parser.add_argument('--papers', type=int, default=200)
+    parser.add_argument('--keywords', type=int, default=5000)
+    parser.add_argument('--bert-rows', type=int, default=2000)
+    parser.add_argument('--skip-bert', action='store_true')
+    parser.add_argument('--postgres', action='store_true',
+                        help='also benchmark insert_data_bulk against the POSTGRES_* database (writes rows!)')
+    parser.add_argument('--output', help='write the JSON results to this file')
+    args = parser.parse_args(argv)
+
+    report = run_suite(args.papers, args.keywords, args.bert_rows, args.skip_bert, args.postgres)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
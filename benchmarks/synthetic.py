@@ -0,0 +1,140 @@
+"""
+Synthetic papers, keyword tables and a local SQLite stand-in of the Postgres database for the benchmarks.
+"""
+import os
+import random
+import re
+import sqlite3
+import string
+
+import pandas as pd
+
+
+def synthetic_keywords(num_keywords, seed=0):
+    """
+    Generates random lowercase keywords of one to three words
+    returns: list of keywords
+    """
+    rnd = random.Random(seed)
+    keywords = set()
+    while len(keywords) < num_keywords:
+        words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(3, 10)))
+                 for _ in range(rnd.randint(1, 3))]
+        keywords.add(' '.join(words))
+    return sorted(keywords)
+
+
+def synthetic_sentences(keywords, num_sentences, seed=1):
+    """
+    Generates random sentences with a few keywords planted into filler words
+    returns: list of sentences
+    """
+    rnd = random.Random(seed)
+    sentences = []
+    for _ in range(num_sentences):
+        words = [''.join(rnd.choices(string.ascii_lowercase, k=rnd.randint(2, 9))) for _ in range(rnd.randint(10, 40))]
+        for _ in range(rnd.randint(0, 3)):
+            words.insert(rnd.randint(0, len(words)), rnd.choice(keywords))
+        sentences.append(' '.join(words))
+    return sentences
+
+
+def keywords_table(keywords, seed=2):
+    """
+    Keywords table in the shape of {schema}.keywords: several keywords (abbreviations, synonyms)
+    share one normalized term
+    returns: pandas.DataFrame
+    """
+    rnd = random.Random(seed)
+    terms = [f'term {i}' for i in range(max(len(keywords) // 3, 1))]
+    normalized = [rnd.choice(terms) for _ in keywords]
+    return pd.DataFrame({'id': range(1, len(keywords) + 1), 'name': keywords, 'normalized_term': normalized,
+                         'general_term': [f'general {term}' for term in normalized],
+                         'displayed_term': [term.title() for term in normalized]})
+
+
+def write_corpus(directory, keywords, num_papers, sentences_per_paper=(50, 500), seed=3):
+    """
+    Writes synthetic papers (Abstract ... References) to directory
+    returns: documents table in the shape of {schema}.documents, file_location relative to directory
+    """
+    rnd = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    rows = []
+    for i in range(1, num_papers + 1):
+        sentences = synthetic_sentences(keywords, rnd.randint(*sentences_per_paper), seed=seed * 100003 + i)
+        paragraphs = ['. '.join(sentences[j:j + 8]) + '.' for j in range(0, len(sentences), 8)]
+        text = 'Title line\n\nAbstract\n' + '\n\n'.join(paragraphs) + '\n\nReferences\n1. Someone et al.'
+        with open(os.path.join(directory, f'paper_{i}.txt'), 'w', encoding='utf8') as f:
+            f.write(text)
+        rows.append({'id': i, 'file_location': f'paper_{i}.bib', 'doi': f'10.0/{i}', 'url': f'https://doi.org/10.0/{i}',
+                     'year': 2000 + i % 24, 'author': 'Someone', 'title': f'Paper {i}', 'journal': 'Journal'})
+    return pd.DataFrame(rows)
+
+
+def _to_sqlite(query):
+    # psycopg2 placeholders, DEFAULT and SERIAL ids, row locks (SQLite locks the whole database for a write anyway)
+    # and schema qualified index targets -> SQLite
+    query = query.replace('%s', '?').replace('DEFAULT,', 'NULL,').replace('SERIAL PRIMARY KEY', 'INTEGER PRIMARY KEY')
+    return re.sub(r' ON main\.', ' ON ', query.replace('FOR UPDATE SKIP LOCKED', ''))
+
+
+class _Cursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(_to_sqlite(query), params)
+        return self
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteStandIn:
+    """
+    Local stand-in of the Postgres database with the documents/keywords/sentences/relationships schema,
+    accepting the psycopg2 style statements of insert_data. Tables live in the 'main' schema,
+    so the code under test is called with schema_name='main'. Postgres only features (COPY) are not emulated.
+    """
+
+    def __init__(self, path=':memory:'):
+        self.raw = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.raw.executescript("""
+            CREATE TABLE IF NOT EXISTS documents (id INTEGER PRIMARY KEY, file_location TEXT, doi TEXT, url TEXT,
+                year INTEGER, author TEXT, title TEXT, journal TEXT);
+            CREATE TABLE IF NOT EXISTS keywords (id INTEGER PRIMARY KEY, name TEXT, normalized_term TEXT,
+                general_term TEXT, displayed_term TEXT);
+            CREATE TABLE IF NOT EXISTS sentences (id INTEGER PRIMARY KEY AUTOINCREMENT, sentences TEXT,
+                document_id INTEGER, sentence_hash TEXT);
+            CREATE UNIQUE INDEX IF NOT EXISTS sentences_sentence_hash ON sentences (sentence_hash);
+            CREATE TABLE IF NOT EXISTS relationships (id INTEGER PRIMARY KEY AUTOINCREMENT, document_id INTEGER,
+                sentence_id INTEGER, keyword1 TEXT, keyword2 TEXT, category TEXT);
+        """)
+        self.raw.execute('BEGIN')
+
+    def load(self, table, df):
+        df.to_sql(table, self.raw, if_exists='append', index=False)
+        self.commit()
+
+    def cursor(self):
+        return _Cursor(self.raw.cursor())
+
+    def commit(self):
+        if self.raw.in_transaction:
+            self.raw.execute('COMMIT')
+        self.raw.execute('BEGIN')
+
+    def rollback(self):
+        if self.raw.in_transaction:
+            self.raw.execute('ROLLBACK')
+        self.raw.execute('BEGIN')
+
+    def close(self):
+        self.raw.close()
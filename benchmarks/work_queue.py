@@ -0,0 +1,107 @@
+"""
+Exercise of the database-backed work queue with several local worker processes: the batches are enqueued once,
+the workers claim them concurrently, keep their leases alive with heartbeats and one worker is killed in the middle
+of its first batch, whose lease has to expire and be claimed by another worker. At the end every batch has to be
+done, completed by exactly one worker, the killed worker has to have exited with an error and its batch has to have
+been claimed again.
+
+Runs against a SQLite stand-in of the database by default, or against the POSTGRES_* database with --postgres
+(the analysis_jobs and work_queue_log tables of POSTGRES_SCHEMA are emptied first!).
+
+Usage: python -m benchmarks.work_queue [--workers N] [--jobs N] [--lease SECONDS] [--postgres]
+"""
+import argparse
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+import src.db.work_queue as wq
+from benchmarks.synthetic import SQLiteStandIn
+
+
+def _connect(db_path):
+    if db_path is None:
+        import psycopg2
+        from src.db.connection_pool import connection_params
+
+        return psycopg2.connect(**connection_params()), os.getenv('POSTGRES_SCHEMA')
+    return SQLiteStandIn(db_path), 'main'
+
+
+def _worker(db_path, lease_seconds, crash_after, seed):
+    conn, schema_name = _connect(db_path)
+    keeper_conn, _ = _connect(db_path)
+    worker = wq.worker_name()
+    rnd = random.Random(seed)
+    with wq.LeaseKeeper(keeper_conn, worker, schema_name, lease_seconds):
+        for done, id_range in enumerate(wq.iter_claimed_jobs(conn, worker, schema_name, lease_seconds=lease_seconds,
+                                                             poll_interval=lease_seconds / 4)):
+            # longer than a lease, the heartbeats have to keep the batch
+            time.sleep(rnd.choice([0.01, 0.05, lease_seconds * 1.5 if rnd.random() < 0.05 else 0.02]))
+            if done == crash_after:
+                # dies holding the batch, without finishing it
+                os._exit(1)
+            if wq.finish_job(conn, id_range, worker, schema_name):
+                curr = conn.cursor()
+                curr.execute(f"INSERT INTO {schema_name}.work_queue_log (first_id, worker) VALUES (%s, %s)",
+                             (id_range[0], worker))
+                conn.commit()
+                curr.close()
+    conn.close()
+    keeper_conn.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Several local workers sharing the database work queue')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--jobs', type=int, default=200)
+    parser.add_argument('--lease', type=float, default=2.0, help='lease seconds')
+    parser.add_argument('--postgres', action='store_true')
+    args = parser.parse_args(argv)
+
+    db_path = None if args.postgres else os.path.join(tempfile.mkdtemp(), 'queue.db')
+    conn, schema_name = _connect(db_path)
+    wq.add_jobs_table(conn, schema_name)
+    curr = conn.cursor()
+    curr.execute(f"CREATE TABLE IF NOT EXISTS {schema_name}.work_queue_log (first_id INTEGER, worker TEXT)")
+    curr.execute(f"DELETE FROM {schema_name}.analysis_jobs")
+    curr.execute(f"DELETE FROM {schema_name}.work_queue_log")
+    conn.commit()
+    added = wq.enqueue_jobs(conn, [(i * 10 + 1, i * 10 + 10) for i in range(args.jobs)], schema_name)
+    # enqueuing the same ranges again (another node) adds nothing
+    added_again = wq.enqueue_jobs(conn, [(i * 10 + 1, i * 10 + 10) for i in range(args.jobs)], schema_name)
+    print(f'enqueued {added} batches, {added_again} on the second enqueue')
+
+    start = time.perf_counter()
+    # the first worker dies holding the first batch it claims
+    processes = [multiprocessing.Process(target=_worker, args=(db_path, args.lease, 0 if n == 0 else None, n))
+                 for n in range(args.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    curr.execute(f"SELECT status, COUNT(*), MAX(attempts) FROM {schema_name}.analysis_jobs GROUP BY status")
+    statuses = curr.fetchall()
+    curr.execute(f"""SELECT COUNT(*), COUNT(DISTINCT first_id), COUNT(DISTINCT worker)
+                     FROM {schema_name}.work_queue_log""")
+    completions, distinct_jobs, workers = curr.fetchone()
+    conn.commit()
+    curr.close()
+    conn.close()
+
+    print(f'{args.workers} workers (exit codes {[process.exitcode for process in processes]}), {elapsed:.2f}s, '
+          f'{args.jobs / elapsed:.1f} batches/s')
+    print('jobs by status (status, count, max attempts):', statuses)
+    print(f'completions {completions}, distinct batches {distinct_jobs}, by {workers} workers')
+    assert completions == distinct_jobs == args.jobs, 'every batch has to be completed exactly once'
+    assert [row[0] for row in statuses] == ['done'], 'all the batches have to be done'
+    assert processes[0].exitcode not in (0, None), 'the killed worker has to die in the middle of a batch'
+    assert max(row[2] for row in statuses) >= 2, 'the batch of the killed worker has to be claimed again'
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,37 @@
+import argparse
+import contextlib
 import os
 import ntpath
+import shutil
 import sys
+import threading
 import time
 import warnings
 from datetime import datetime
+from functools import partial
+
+_start_time = time.time()
 
 import numpy as np
 import pandas as pd
 import psycopg2
 from dotenv import load_dotenv
-from joblib import Parallel, delayed
-import src.model.bert_prediction as bp
+from joblib.externals.loky import get_reusable_executor
+import src.utils.bert_inputs as bi
 import src.utils.keywords_detection as kd
+import src.utils.keyword_dictionary as kw
+import src.utils.metrics as metrics
+import src.utils.parquet_sink as ps
 import src.utils.result_preparation as rp
 import src.utils.text_postprocessing as po
 import src.utils.text_preprocessing as pr
 import src.db.input_preparation as ip
-from src.db.database_create import add_table_with_results, insert_data
-
-load_dotenv()
-
-model_path = os.getenv('MODEL_PATH')
-documents_disk_path = os.getenv('DOCUMENTS_PATH')
-
-model, tokenizer = bp.load_model_and_tokenizer(model_path, num_of_labels=4)
-
-db_limit = 10
-start_offset = int(os.getenv('START_DOCUMENT_OFFSET'))
-max_offset = int(os.getenv('MAX_DOCUMENT_OFFSET'))
+import src.db.work_queue as wq
+from src.db.database_create import add_table_with_results, insert_data_bulk
+from src.db.connection_pool import connection_params, pool_max, pooled_connection
+from src.db.progress_ledger import add_progress_table, mark_documents_done, mark_range_failed
+from src.db.sentence_dedup import add_sentence_hash_column, backfill_sentence_hashes
+from src.utils.pipeline import Stage, run_pipeline
 
 ### constants ###
 output_cols = ['doi', 'url', 'year', 'author', 'title', 'journal',
@@ -43,22 +47,22 @@ cols_to_merge = ['paper', '1st_keyword', '2nd_keyword', 'sentences', 'general_te
                 ]
 
 
-def run_analyzer(conn, db_offset=0, db_limit=1, schema_name=''):
+def run_analyzer(conn, first_id, last_id, schema_name='', documents_path='', mode='all'):
     warnings.filterwarnings("ignore")
 
     current_date = datetime.now().strftime("%Y-%m-%d")
     start_time = time.time()
 
-    keywords = ip.sql2df(query=f"SELECT * from {schema_name}.keywords", db=conn)
-    keywords = ip.clean_keywords(df=keywords, col='name')
+    keyword_dictionary = kw.get_keyword_dictionary(conn, schema_name=schema_name)
+    keywords = keyword_dictionary.keywords
 
-    # query = """SELECT * FROM documents WHERE file_location NOT LIKE "%RECYCLE%" AND file_location LIKE "%oa_noncomm_txt\PMC005xxxxxx%";"""
-    query = f"""SELECT * FROM {schema_name}.documents LIMIT {db_limit} OFFSET {db_offset} ;"""
-    selection_bib = ip.sql2df(query=query, db=conn)
+    with metrics.timer('select_documents'):
+        selection_bib = ip.select_documents(conn, first_id, last_id, schema_name=schema_name, mode=mode)
+    document_ids = selection_bib['id'].tolist()
     selection_bib['file_loc'] = selection_bib['file_location'].str.replace('.bib', '.txt')
 
-    selection_bib['file_loc'] = f'{documents_disk_path}' + selection_bib['file_loc']
-    selection_bib['file_location'] = f'{documents_disk_path}' + selection_bib['file_location']
+    selection_bib['file_loc'] = f'{documents_path}' + selection_bib['file_loc']
+    selection_bib['file_location'] = f'{documents_path}' + selection_bib['file_location']
     
     if sys.platform == 'linux':
         selection_bib['file_loc'] = selection_bib['file_loc'].apply(lambda x: x.replace(ntpath.sep, os.sep))
@@ -67,80 +71,387 @@ def run_analyzer(conn, db_offset=0, db_limit=1, schema_name=''):
         selection_bib['file_loc'] = selection_bib['file_loc'].apply(lambda x: x.replace(os.sep, ntpath.sep))
         selection_bib['file_location'] = selection_bib['file_location'].apply(lambda x: x.replace(os.sep, ntpath.sep))
 
-    pr.remove_text(df=selection_bib,
-                   stopwords_before=['Abstract', 'ABS T R AC T', 'ABSTRACT'],
-                   stopwords_after=['References', 'REFERENCES',
-                                    'Abbreviations', 'ABBREVIATIONS'])
+    with metrics.timer('sanitized_spans'):
+        selection_bib = pr.add_sanitized_spans(df=selection_bib,
+                                               stopwords_before=['Abstract', 'ABS T R AC T', 'ABSTRACT'],
+                                               stopwords_after=['References', 'REFERENCES',
+                                                                'Abbreviations', 'ABBREVIATIONS'],
+                                               cache_path=pr.span_cache_path())
 
-    df_paper = kd.get_relations(df=selection_bib, kword_col=keywords['name'], conn=conn, schema_name=schema_name)
+    df_paper = kd.get_relations(df=selection_bib, kword_col=keywords['name'], conn=conn, schema_name=schema_name,
+                                matcher=keyword_dictionary.matcher, prefilter=keyword_dictionary.prefilter)
 
-    df_paper = po.adding_norm_terms(df=df_paper, df_kwords=keywords)
-
-    df_paper = df_paper[df_paper['normalized_term_x'] != df_paper['normalized_term_y']]
+    with metrics.timer('adding_norm_terms'):
+        # drops the relations between keywords with the same normalized term as well
+        df_paper = po.adding_norm_terms_indexed(df=df_paper, keyword_index=keyword_dictionary.index)
 
     df_paper['category'] = np.nan
 
     selection_bib = rp.extract_filename(df=selection_bib, input_col='file_location', output_col='doi_join')
     df_paper = rp.extract_filename(df=df_paper, input_col='paper', output_col='paper_name')
 
-    result = rp.merge_relations_and_info(df=df_paper, bib_df=selection_bib,
-                                         cols=output_cols, left_join='doi_join', right_join='paper_name')
-    result = rp.sorting_data(df=result, cols=['year', 'title'], asc=[False, True])
+    with metrics.timer('merge_relations'):
+        result = rp.merge_relations_and_info(df=df_paper, bib_df=selection_bib,
+                                             cols=output_cols, left_join='doi_join', right_join='paper_name')
+        result = rp.sorting_data(df=result, cols=['year', 'title'], asc=[False, True])
     result['publisher'] = ' '
 
     end_time = time.time()
     elapsed_time = end_time - start_time
+    metrics.observe('preprocessing', elapsed_time)
 
-    # print("OFFSET: ", db_offset, ". Elapsed time in seconds: ", elapsed_time, ". Dataframe shape:", result.shape)
-    return result
-
-
-num_cores = os.cpu_count()
-print('NUMBER OF CORES: ', num_cores)
-
-offsets = [start_offset]
-while max(offsets) <= max_offset: offsets.append(offsets[-1] + db_limit)
-
-def run_analyzer_wrapped(db_offset, db_limit):
-    conn = psycopg2.connect(host=os.getenv('POSTGRES_HOST'), dbname=os.getenv('POSTGRES_DB_NAME'),
-                            user=os.getenv('POSTGRES_USER'), password=os.getenv('POSTGRES_PASSWORD'))
-    return run_analyzer(conn, db_offset, db_limit, schema_name=os.getenv('POSTGRES_SCHEMA'))
+    # print("IDS: ", first_id, last_id, ". Elapsed time in seconds: ", elapsed_time, ". Dataframe shape:", result.shape)
+    return result, document_ids
 
-def insert_data_wrapped(df):
-    conn = psycopg2.connect(host=os.getenv('POSTGRES_HOST'), dbname=os.getenv('POSTGRES_DB_NAME'),
-                            user=os.getenv('POSTGRES_USER'), password=os.getenv('POSTGRES_PASSWORD'))
-    insert_data(df, conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
-
-
-cores_to_work = max(num_cores-3, 1)
-while len(offsets) > 0:
-    selected_offsets = offsets[:cores_to_work]
-    del offsets[:cores_to_work]
 
+def text_file_size(file_location, documents_path=''):
+    """
+    Estimated cost of a document for the batching: the size of its text file, built like the paths in run_analyzer
+    returns: size in bytes, 0 when the file does not exist
+    """
+    path = f'{documents_path}' + file_location.replace('.bib', '.txt')
+    if sys.platform == 'linux':
+        path = path.replace(ntpath.sep, os.sep)
+    elif 'win' in sys.platform:
+        path = path.replace(os.sep, ntpath.sep)
+    try:
+        return os.stat(path).st_size
+    except OSError:
+        return 0
+
+
+def run_analyzer_wrapped(first_id, last_id, documents_path, mode='all', model_path=None, inputs_dir=None):
+    # the metrics of the batch travel back with the result, the main process aggregates them
+    s_t = time.perf_counter()
+    with pooled_connection() as conn, metrics.scope() as batch_metrics:
+        df, document_ids = run_analyzer(conn, first_id, last_id, schema_name=os.getenv('POSTGRES_SCHEMA'),
+                                        documents_path=documents_path, mode=mode)
+        # the model inputs are tokenized here, in parallel, and handed over as a memory-mapped file
+        with metrics.timer('tokenization'):
+            encoded = bi.encode_inputs(bi.bert_input_texts(df).tolist(), bi.get_tokenizer(model_path),
+                                       directory=inputs_dir)
+    # busy time of this worker process, for the utilization report
+    worker_time = (os.getpid(), time.perf_counter() - s_t)
+    return df, document_ids, encoded, batch_metrics.snapshot(), worker_time
+
+def insert_data_wrapped(df, document_ids=None, sink='postgres', parquet_sink=None):
+    if sink in ('postgres', 'both'):
+        with pooled_connection() as conn:
+            insert_data_bulk(df, conn, schema_name=os.getenv('POSTGRES_SCHEMA'), document_ids=document_ids)
+    if sink == 'parquet':
+        # the documents are marked as done once the files holding them are closed (mark_done_wrapped)
+        parquet_sink.write(df, document_ids=document_ids)
+    elif sink == 'both':
+        # the database is the record of the run, the Parquet copy is best-effort: a failed write does not fail
+        # the batch (which is done already), rows in files left open by a crash are not written again
+        try:
+            parquet_sink.write(df)
+        except Exception as e:
+            print('PARQUET WRITE FAILED: ', e)
+            metrics.inc('parquet_write_errors')
+
+
+def mark_done_wrapped(document_ids):
+    """
+    Records the documents whose Parquet files were closed as done in the progress ledger
+    """
+    with pooled_connection() as conn:
+        curr = conn.cursor()
+        mark_documents_done(curr, document_ids, schema_name=os.getenv('POSTGRES_SCHEMA'))
+        conn.commit()
+        curr.close()
+
+
+def mark_failed(id_range, stage, error, worker=None):
+    """
+    Records the documents of a failed batch in the progress ledger, they are retried with --retry-failed.
+    In the work queue mode the batch held by the worker is marked as failed as well.
+    """
+    print('DOCUMENT IDS: ', id_range[0], '-', id_range[1], f'FAILED IN {stage.upper()}: ', error)
+    with pooled_connection() as conn:
+        mark_range_failed(conn, id_range[0], id_range[1], f'{stage}: {error}', schema_name=os.getenv('POSTGRES_SCHEMA'))
+        if worker is not None:
+            wq.finish_job(conn, id_range, worker, schema_name=os.getenv('POSTGRES_SCHEMA'), error=f'{stage}: {error}')
+
+
+class Inference:
+    """
+    Model, tokenizer and prediction cache of the process running the inference stage.
+    torch/transformers are imported and the model is loaded on the first batch only, so importing this module,
+    starting the run and the preprocessing workers do not pay for it.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.model = None
+        self.tokenizer = None
+        self.cache = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        with self._lock:
+            if self.model is not None:
+                return
+            s_t = time.time()
+            import src.model.backends as mb
+            import src.model.inference_cache as ic
+
+            # optional on-disk cache of predictions, emptied automatically when the model files change
+            if self.args.cache_path:
+                self.cache = ic.PredictionCache(self.args.cache_path,
+                                                f'{ic.model_fingerprint(self.args.model_path)}:{self.args.backend}',
+                                                max_entries=self.args.cache_size)
+            self.model, self.tokenizer = mb.load_model_and_tokenizer(self.args.model_path, num_of_labels=4,
+                                                                     backend=self.args.backend,
+                                                                     onnx_path=self.args.onnx_path)
+            print('MODEL LOADING TIME: ', time.time() - s_t)
+
+    def predict(self, df, encoded):
+        self.load()
+        import src.model.bert_prediction as bp
+        import src.model.inference_cache as ic
+
+        if self.cache is None:
+            return bp.apply_BERT_model_encoded(df=df, encoded=encoded, pred_col='category', model=self.model,
+                                               batch_size=1024, max_tokens=self.args.max_tokens)
+        return ic.apply_BERT_model_encoded_cached(df=df, encoded=encoded, pred_col='category', model=self.model,
+                                                  cache=self.cache, batch_size=1024, max_tokens=self.args.max_tokens)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+
+
+def preprocess_stage(id_range, executor, documents_path, mode='all', model_path=None, utilization=None,
+                     worker=None, inputs_dir=None):
+    first_id, last_id = id_range
     s_t = time.time()
-    dfs = Parallel(n_jobs=cores_to_work)(delayed(run_analyzer_wrapped)(offset, db_limit) for offset in selected_offsets)
-    concatenated_dfs = pd.concat(dfs)
-    e_t = time.time()
-
-    print('OFFSET DIFFERENCE: ', max(selected_offsets) - min(selected_offsets) + db_limit)
-    print('PREPROCESSING TIME: ',  e_t-s_t)
-
+    try:
+        df, document_ids, encoded, snapshot, worker_time = executor.submit(
+            run_analyzer_wrapped, first_id, last_id, documents_path, mode, model_path, inputs_dir).result()
+    except Exception as e:
+        mark_failed(id_range, 'preprocessing', e, worker)
+        return None
+    if utilization is not None:
+        utilization.add(*worker_time)
+    batch_metrics = metrics.Registry()
+    batch_metrics.merge(snapshot)
+    metrics.registry().merge(snapshot)
+    print('DOCUMENT IDS: ', first_id, '-', last_id, 'PREPROCESSING TIME: ', time.time() - s_t)
+    return id_range, document_ids, df, encoded, batch_metrics
+
+
+def inference_stage(item, inference, worker=None):
+    id_range, document_ids, df, encoded, batch_metrics = item
     s_t = time.time()
-    for i in range(len(dfs)):
-        dfs[i]['input_data_bert'] = dfs[i][['sentences', '1st_keyword', '2nd_keyword']] \
-            .apply(lambda x: '.'.join(x.astype(str)), axis=1)
-        dfs[i] = bp.apply_BERT_model(df=dfs[i], input_col='input_data_bert', pred_col='category',
-                                       model=model, tokenizer=tokenizer, batch_size=1024)
-    e_t = time.time()
-    print('MODEL PREDICTION TIME: ', e_t-s_t)
-
+    try:
+        with metrics.scope() as scoped, metrics.timer('inference'):
+            df = inference.predict(df, encoded)
+    except Exception as e:
+        mark_failed(id_range, 'inference', e, worker)
+        return None
+    finally:
+        encoded.release()
+    batch_metrics.merge(scoped.snapshot())
+    print('DOCUMENT IDS: ', id_range[0], '-', id_range[1], 'MODEL PREDICTION TIME: ', time.time() - s_t)
+    return id_range, document_ids, df, batch_metrics
+
+
+def insertion_stage(item, textfile=None, log_path=None, worker=None, sink='postgres', parquet_sink=None):
+    id_range, document_ids, df, batch_metrics = item
     s_t = time.time()
-    Parallel(n_jobs=cores_to_work)(delayed(insert_data_wrapped)(df) for df in dfs)
-    e_t = time.time()
-    print('INSERTION TIME: ', e_t-s_t)
-    print('MAX OFFSET:', max(selected_offsets))
-
+    try:
+        with metrics.scope() as scoped, metrics.timer('insertion'):
+            insert_data_wrapped(df, document_ids, sink=sink, parquet_sink=parquet_sink)
+    except Exception as e:
+        mark_failed(id_range, 'insertion', e, worker)
+        return
+    if worker is not None:
+        with pooled_connection() as conn:
+            if not wq.finish_job(conn, id_range, worker, schema_name=os.getenv('POSTGRES_SCHEMA')):
+                print('DOCUMENT IDS: ', id_range[0], '-', id_range[1], 'LEASE LOST, THE BATCH WAS REQUEUED')
+    batch_metrics.merge(scoped.snapshot())
+    print('DOCUMENT IDS: ', id_range[0], '-', id_range[1], 'INSERTION TIME: ', time.time() - s_t)
+    report_batch(id_range, batch_metrics, textfile=textfile, log_path=log_path)
+
+
+def report_batch(id_range, batch_metrics, textfile=None, log_path=None):
+    """
+    Prints the throughput of a finished batch, appends it to the JSON metrics log and
+    refreshes the Prometheus textfile with the totals of the run
+    """
+    rates = metrics.batch_rates(batch_metrics)
+    print('DOCUMENT IDS: ', id_range[0], '-', id_range[1], 'RATES: ', rates)
+    if log_path:
+        metrics.log_json(log_path, {'first_id': id_range[0], 'last_id': id_range[1], 'time': time.time(),
+                                    'rates': rates, **batch_metrics.snapshot()})
+    if textfile:
+        metrics.write_prometheus_textfile(textfile)
+
+
+def _env_int(name, default=None):
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+def _env_flag(name, default=False):
+    # 1/true/yes/on enable the flag, 0/false/no/off (or an empty value) disable it
+    value = os.getenv(name)
+    if not value:
+        return default
+    if value.strip().lower() in ('1', 'true', 'yes', 'on'):
+        return True
+    if value.strip().lower() in ('0', 'false', 'no', 'off'):
+        return False
+    raise ValueError(f'{name}={value!r} is not a boolean, expected 1/true/yes/on or 0/false/no/off')
+
+
+def parse_args(argv=None):
+    """
+    Command line options, the defaults are taken from the environment (.env)
+    returns: argparse.Namespace
+    """
+    cores_to_work = max(os.cpu_count() - 3, 1)
+    parser = argparse.ArgumentParser(description='Extract keyword relations from papers and classify them with BERT')
+    parser.add_argument('--model-path', default=os.getenv('MODEL_PATH'))
+    parser.add_argument('--documents-path', default=os.getenv('DOCUMENTS_PATH'))
+    parser.add_argument('--start-id', type=int, default=_env_int('START_DOCUMENT_ID', 0))
+    parser.add_argument('--max-id', type=int, default=_env_int('MAX_DOCUMENT_ID'))
+    parser.add_argument('--batch-size', type=int, default=_env_int('DOCUMENT_BATCH_SIZE', 10),
+                        help='maximum documents per preprocessing batch')
+    parser.add_argument('--batch-bytes', type=int, default=_env_int('DOCUMENT_BATCH_BYTES', 1 << 20),
+                        help='maximum size of the text files of a preprocessing batch, 0 for batches of --batch-size')
+    parser.add_argument('--reprocess', action='store_true',
+                        help='process the documents already marked as done in the progress ledger again')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='process only the documents marked as failed in the progress ledger')
+    parser.add_argument('--preprocess-workers', type=int, default=_env_int('PREPROCESS_WORKERS', cores_to_work))
+    parser.add_argument('--insert-workers', type=int, default=_env_int('INSERT_WORKERS', 2),
+                        help='insertion threads, at most POSTGRES_POOL_MAX (they share the pool of the process)')
+    parser.add_argument('--queue-size', type=int, default=_env_int('PIPELINE_QUEUE_SIZE', 2))
+    parser.add_argument('--backend', default=os.getenv('INFERENCE_BACKEND', 'pytorch'),
+                        choices=['pytorch', 'pytorch-int8', 'onnx'])
+    parser.add_argument('--onnx-path', default=os.getenv('ONNX_MODEL_PATH'))
+    # token budget of a length-bucketed inference batch, fixed 1024 row batches when not set
+    parser.add_argument('--max-tokens', type=int, default=_env_int('BERT_MAX_TOKENS'))
+    parser.add_argument('--cache-path', default=os.getenv('INFERENCE_CACHE_PATH'))
+    parser.add_argument('--cache-size', type=int, default=_env_int('INFERENCE_CACHE_SIZE', 1_000_000))
+    parser.add_argument('--enqueue', action='store_true',
+                        help='add the document batches to the work queue (analysis_jobs table) shared by all nodes')
+    parser.add_argument('--work-queue', action='store_true', default=_env_flag('WORK_QUEUE'),
+                        help='process the batches claimed from the work queue instead of the --start-id/--max-id range')
+    parser.add_argument('--lease-seconds', type=int, default=_env_int('JOB_LEASE_SECONDS', wq.LEASE_SECONDS),
+                        help='a claimed batch without a heartbeat for this long is requeued')
+    parser.add_argument('--max-attempts', type=int, default=_env_int('JOB_MAX_ATTEMPTS', wq.MAX_ATTEMPTS))
+    parser.add_argument('--sink', choices=['postgres', 'parquet', 'both'], default=os.getenv('RESULT_SINK', 'postgres'),
+                        help='where the results are written: the database tables, Parquet files or both')
+    parser.add_argument('--parquet-path', default=os.getenv('PARQUET_PATH'),
+                        help='root directory of the Parquet dataset (--sink parquet or both)')
+    parser.add_argument('--parquet-row-group', type=int, default=_env_int('PARQUET_ROW_GROUP_SIZE', ps.ROW_GROUP_SIZE),
+                        help='rows per Parquet row group')
+    parser.add_argument('--backfill-sentence-hashes', action='store_true',
+                        help='hash the sentences stored before the sentence deduplication, so they are reused too')
+    parser.add_argument('--metrics-textfile', default=os.getenv('METRICS_TEXTFILE'),
+                        help='Prometheus textfile refreshed after every batch')
+    parser.add_argument('--metrics-log', default=os.getenv('METRICS_LOG'),
+                        help='JSON lines file with the metrics of every batch')
+    args = parser.parse_args(argv)
+    if args.sink != 'postgres' and not args.parquet_path:
+        parser.error('--parquet-path (PARQUET_PATH) is required with --sink parquet or both')
+    if args.insert_workers > pool_max():
+        parser.error(f'--insert-workers (INSERT_WORKERS) is {args.insert_workers}, '
+                     f'at most POSTGRES_POOL_MAX={pool_max()} connections are available')
+    return args
+
+
+def main(argv=None):
+    load_dotenv()
+    args = parse_args(argv)
+    print('NUMBER OF CORES: ', os.cpu_count())
+
+    executor = get_reusable_executor(max_workers=args.preprocess_workers)
+    inference = Inference(args)
+    main_conn = psycopg2.connect(**connection_params())
+    add_progress_table(main_conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
+    if args.sink != 'parquet':
+        # every distinct sentence is stored once, repeated sentences are resolved by their hash
+        add_sentence_hash_column(main_conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
+        if args.backfill_sentence_hashes:
+            print('HASHED SENTENCES: ', backfill_sentence_hashes(main_conn, schema_name=os.getenv('POSTGRES_SCHEMA')))
+    # done documents are skipped, so a restart resumes right after the last committed batch
+    mode = 'failed' if args.retry_failed else 'all' if args.reprocess else 'pending'
+    if args.batch_bytes:
+        # batches sized by the text files, a huge paper is processed alone instead of holding up a batch
+        id_ranges = ip.iter_document_id_ranges_by_cost(main_conn, partial(text_file_size,
+                                                                          documents_path=args.documents_path),
+                                                       schema_name=os.getenv('POSTGRES_SCHEMA'),
+                                                       max_cost=args.batch_bytes, batch_size=args.batch_size,
+                                                       start_id=args.start_id, max_id=args.max_id, mode=mode)
+    else:
+        id_ranges = ip.iter_document_id_ranges(main_conn, schema_name=os.getenv('POSTGRES_SCHEMA'),
+                                               batch_size=args.batch_size, start_id=args.start_id,
+                                               max_id=args.max_id, mode=mode)
+    if args.enqueue or args.work_queue:
+        wq.add_jobs_table(main_conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
+    if args.enqueue:
+        added = wq.enqueue_jobs(main_conn, id_ranges, schema_name=os.getenv('POSTGRES_SCHEMA'))
+        print('ENQUEUED BATCHES: ', added)
+        if not args.work_queue:
+            main_conn.close()
+            return
+    worker = None
+    lease_keeper = contextlib.nullcontext()
+    if args.work_queue:
+        # batches are claimed from the queue as the pipeline asks for them, the leases are renewed in the background
+        worker = wq.worker_name()
+        id_ranges = wq.iter_claimed_jobs(main_conn, worker, schema_name=os.getenv('POSTGRES_SCHEMA'),
+                                         lease_seconds=args.lease_seconds, max_attempts=args.max_attempts)
+        lease_keeper = wq.LeaseKeeper(psycopg2.connect(**connection_params()), worker,
+                                      schema_name=os.getenv('POSTGRES_SCHEMA'), lease_seconds=args.lease_seconds)
+    # build the shared keyword dictionary file once, the workers only load it
+    kw.load_keyword_dictionary(main_conn, schema_name=os.getenv('POSTGRES_SCHEMA'))
+    print('STARTUP TIME: ', time.time() - _start_time)
+    # load the model in the background while the first batches are preprocessed
+    threading.Thread(target=inference.load, name='model-loading', daemon=True).start()
+
+    parquet_sink = None
+    if args.sink != 'postgres':
+        # Parquet only: the documents are marked as done once the files holding their results are closed
+        parquet_sink = ps.ParquetSink(args.parquet_path, row_group_size=args.parquet_row_group,
+                                      on_commit=mark_done_wrapped if args.sink == 'parquet' else None)
+
+    # hand-off files of the tokenized batches, the whole directory is removed at the end of the run
+    inputs_dir = bi.create_inputs_dir()
 
-# Parallel(n_jobs=)(delayed(run_analyzer_wrapped)(offset, db_limit) for offset in offsets)
-
-# run_analyzer_wrapped(0, 100)
+    s_t = time.time()
+    utilization = metrics.Utilization()
+    try:
+        with lease_keeper:
+            processed = run_pipeline(id_ranges, [
+                Stage('preprocessing', partial(preprocess_stage, executor=executor, documents_path=args.documents_path,
+                                               mode=mode, model_path=args.model_path, utilization=utilization,
+                                               worker=worker, inputs_dir=inputs_dir),
+                      workers=args.preprocess_workers),
+                Stage('inference', partial(inference_stage, inference=inference, worker=worker), workers=1),
+                Stage('insertion', partial(insertion_stage, textfile=args.metrics_textfile, log_path=args.metrics_log,
+                                           worker=worker, sink=args.sink, parquet_sink=parquet_sink),
+                      workers=args.insert_workers)],
+                queue_size=args.queue_size)
+    finally:
+        # batches dropped when the pipeline stopped (error, Ctrl-C) were never released by the inference stage
+        shutil.rmtree(inputs_dir, ignore_errors=True)
+        if parquet_sink is not None:
+            parquet_sink.close()
+        main_conn.close()
+        if args.work_queue:
+            lease_keeper.conn.close()
+        inference.close()
+    print('PROCESSED BATCHES: ', processed, 'TOTAL TIME: ', time.time() - s_t)
+    worker_utilization = utilization.report(workers=args.preprocess_workers)
+    print('PREPROCESSING WORKER UTILIZATION: ', worker_utilization)
+    if args.metrics_log:
+        metrics.log_json(args.metrics_log, {'time': time.time(), 'worker_utilization': worker_utilization})
+
+
+if __name__ == '__main__':
+    main()
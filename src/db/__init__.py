@@ -1,2 +1,6 @@
 from src.db.database_create import *
-from src.db.input_preparation import *
\ No newline at end of file
+from src.db.input_preparation import *
+from src.db.connection_pool import *
+from src.db.progress_ledger import *
+from src.db.work_queue import *
+from src.db.sentence_dedup import *
\ No newline at end of file
@@ -0,0 +1,133 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import psycopg2
+from psycopg2 import pool
+
+# connections idle for longer than this are pinged before they are handed out
+HEALTHCHECK_INTERVAL = 30
+
+_pool = None
+_pool_pid = None
+# one slot per connection of the pool: getconn raises instead of waiting when the pool is exhausted
+_slots = None
+_last_used = {}
+_lock = threading.Lock()
+
+
+def connection_params():
+    """
+    Connection parameters of the Postgres database taken from the environment
+    returns: dict
+    """
+    return dict(host=os.getenv('POSTGRES_HOST'), dbname=os.getenv('POSTGRES_DB_NAME'),
+                user=os.getenv('POSTGRES_USER'), password=os.getenv('POSTGRES_PASSWORD'))
+
+
+def pool_max():
+    """
+    returns: maximum number of connections of the pool of every process (POSTGRES_POOL_MAX, default 4)
+    """
+    return int(os.getenv('POSTGRES_POOL_MAX', 4))
+
+
+def get_pool():
+    """
+    Returns the connection pool of the current process, the pool is created lazily on the first use.
+    A pool inherited from the parent through fork is not reused, its sockets belong to the parent.
+    The size is bounded by POSTGRES_POOL_MIN / POSTGRES_POOL_MAX (default 1 / 4).
+    returns: psycopg2.pool.ThreadedConnectionPool
+    """
+    global _pool, _pool_pid, _slots
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = pool.ThreadedConnectionPool(int(os.getenv('POSTGRES_POOL_MIN', 1)), pool_max(),
+                                                **connection_params())
+            _slots = threading.BoundedSemaphore(pool_max())
+            _pool_pid = os.getpid()
+            _last_used.clear()
+        return _pool
+
+
+def _is_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _last_used.get(id(conn))
+    if last_used is None or time.monotonic() - last_used < HEALTHCHECK_INTERVAL:
+        return True
+    try:
+        with conn.cursor() as curr:
+            curr.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def borrow_connection():
+    """
+    Takes a healthy connection from the pool, broken connections are discarded and replaced.
+    Waits while all the connections of the pool are borrowed.
+    returns: psycopg2 connection
+    """
+    conn_pool = get_pool()
+    _slots.acquire()
+    try:
+        conn = conn_pool.getconn()
+        while not _is_healthy(conn):
+            conn_pool.putconn(conn, close=True)
+            _last_used.pop(id(conn), None)
+            conn = conn_pool.getconn()
+    except BaseException:
+        _slots.release()
+        raise
+    return conn
+
+
+def release_connection(conn):
+    """
+    Returns the connection to the pool, an unfinished transaction is rolled back first
+    """
+    if not conn.closed:
+        try:
+            conn.rollback()
+        except psycopg2.Error:
+            pass
+    _last_used[id(conn)] = time.monotonic()
+    try:
+        get_pool().putconn(conn, close=bool(conn.closed))
+    finally:
+        _slots.release()
+
+
+@contextmanager
+def pooled_connection():
+    """
+    Context manager borrowing a connection from the pool of the current process and giving it back afterwards
+    returns: psycopg2 connection
+    """
+    conn = borrow_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
+
+
+def close_pool():
+    """
+    Closes all the connections of the pool of the current process
+    """
+    global _pool, _pool_pid, _slots
+    with _lock:
+        if _pool is not None and _pool_pid == os.getpid():
+            _pool.closeall()
+        _pool = None
+        _pool_pid = None
+        _slots = None
+        _last_used.clear()
+
+
+atexit.register(close_pool)
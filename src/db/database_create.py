@@ -1,3 +1,10 @@
+import csv
+import io
+import time
+
+import src.utils.metrics as metrics
+from src.db.progress_ledger import mark_documents_done
+from src.db.sentence_dedup import lookup_sentence_ids, sentence_hashes, sentence_id_cache
 
 
 def add_table_with_results(conn):
@@ -29,31 +36,62 @@ def add_table_with_results(conn):
     return conn
 
 
-def insert_data(df, conn, schema_name=''):
+def insert_data(df, conn, schema_name='', document_ids=None):
+    """
+    Row by row insert, a row the database rejects is skipped. document_ids are recorded as done in the progress
+    ledger in the transaction of the relationships.
+    returns: number of inserted relationships
+    """
     counter = 0
     curr = conn.cursor()
 
+    sentences_start = time.perf_counter()
     sentences_unique = df.groupby(['sentences'])[['sentences', 'bib_id']].agg(lambda x: x.unique()[0])
-    id_mapping = {}
+    # sentences already stored (by any batch or node) are reused by their hash, recent ones without a query
+    hashes = sentence_hashes(sentences_unique['sentences'])
+    cache = sentence_id_cache(schema_name)
+    cached = cache.get_many(hashes.values())
+    id_mapping = {sentence: cached[sentence_hash] for sentence, sentence_hash in hashes.items()
+                  if sentence_hash in cached}
+    resolved, inserted = {}, 0
     for _, row in sentences_unique.iterrows():
+        sentence_hash = hashes[row['sentences']]
+        if sentence_hash in cached:
+            continue
         try:
+            # a failed statement would abort the whole transaction, the savepoint drops only the bad row
+            curr.execute('SAVEPOINT row_insert')
             curr.execute(f"""
-                INSERT INTO {schema_name}.sentences (sentences, document_id)
-                   VALUES (%s, %s) RETURNING id
-                   """, (row['sentences'], row['bib_id']))
-
-            sentence_id = curr.fetchone()[0]
-
-            id_mapping[row['sentences']] = sentence_id
+                INSERT INTO {schema_name}.sentences (sentence_hash, sentences, document_id)
+                   VALUES (%s, %s, %s) ON CONFLICT (sentence_hash) DO NOTHING RETURNING id
+                   """, (sentence_hash, row['sentences'], row['bib_id']))
+
+            sentence_id = curr.fetchone()
+            if sentence_id is None:
+                curr.execute(f"SELECT id FROM {schema_name}.sentences WHERE sentence_hash = %s", (sentence_hash,))
+                sentence_id = curr.fetchone()
+            else:
+                inserted += 1
+
+            id_mapping[row['sentences']] = resolved[sentence_hash] = sentence_id[0]
+            curr.execute('RELEASE SAVEPOINT row_insert')
             # curr.execute('COMMIT')
         except Exception as e:
             print(f"Error was detected: {e}")
+            curr.execute('ROLLBACK TO SAVEPOINT row_insert')
             continue
 
     conn.commit()
+    cache.put_many(resolved)
+    metrics.observe('insert_sentences', time.perf_counter() - sentences_start)
+    metrics.inc('inserted_rows', inserted)
+    metrics.inc('sentence_cache_hits', len(cached))
+    metrics.inc('sentences_deduplicated', len(id_mapping) - inserted)
 
+    relationships_start = time.perf_counter()
     for index, row in df.iterrows():
         try:
+            curr.execute('SAVEPOINT row_insert')
             curr.execute(f"""
                 INSERT INTO {schema_name}.relationships (
                     id, document_id, sentence_id, keyword1, keyword2, category
@@ -66,14 +104,109 @@ def insert_data(df, conn, schema_name=''):
                 row['1st_keyword'], row['2nd_keyword'],
                 str(row['category'])
             ))
+            curr.execute('RELEASE SAVEPOINT row_insert')
             counter += 1
         except Exception as e:
             print(f"Error was detected: {e}")
+            curr.execute('ROLLBACK TO SAVEPOINT row_insert')
             continue
 
     # print("Data inserted successfully. In total {} rows".format(counter))
+    if document_ids is not None:
+        mark_documents_done(curr, document_ids, schema_name=schema_name)
     conn.commit()
-    conn.close()
+    metrics.observe('insert_relationships', time.perf_counter() - relationships_start)
+    metrics.inc('inserted_rows', counter)
+    return counter
+
+
+def _copy_df(curr, df, table, cols):
+    """
+    Streams the dataframe to the table with COPY FROM STDIN (CSV, strings quoted so '' stays an empty string)
+    """
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_NONNUMERIC)
+    buffer.seek(0)
+    curr.copy_expert(f"COPY {table} ({', '.join(cols)}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def insert_data_bulk(df, conn, schema_name='', document_ids=None):
+    """
+    Bulk variant of insert_data: the sentences are resolved by their hash from the in-process cache and then by one
+    lookup query, only the new ones are staged with COPY into a temporary table and inserted by a single
+    INSERT ... SELECT ... ON CONFLICT DO NOTHING RETURNING, the relationships are then copied in one COPY.
+    The whole batch is committed once. If anything fails the batch is rolled back and written again by insert_data,
+    which skips only the rows the database rejects.
+    document_ids are recorded as done in the progress ledger, in the same transaction as their results.
+    returns: number of inserted relationships
+    """
+    start_time = time.time()
+    curr = conn.cursor()
+    try:
+        sentences_start = time.perf_counter()
+        sentences_unique = df.drop_duplicates(subset='sentences')[['sentences', 'bib_id']].reset_index(drop=True)
+        sentences_unique['bib_id'] = sentences_unique['bib_id'].astype('int64')
+        hashes = sentence_hashes(sentences_unique['sentences'])
+        sentences_unique['sentence_hash'] = sentences_unique['sentences'].map(hashes)
+
+        cache = sentence_id_cache(schema_name)
+        hash_ids = cache.get_many(hashes.values())
+        cached = len(hash_ids)
+        hash_ids.update(lookup_sentence_ids(curr, [h for h in hashes.values() if h not in hash_ids], schema_name))
+        new_sentences = sentences_unique[~sentences_unique['sentence_hash'].isin(list(hash_ids))]
+        inserted = 0
+        if len(new_sentences):
+            curr.execute("""CREATE TEMP TABLE stage_sentences (
+                sentence_hash uuid,
+                sentences text,
+                document_id integer
+            ) ON COMMIT DROP""")
+            _copy_df(curr, new_sentences[['sentence_hash', 'sentences', 'bib_id']], 'stage_sentences',
+                     ['sentence_hash', 'sentences', 'document_id'])
+            curr.execute(f"""
+                INSERT INTO {schema_name}.sentences (sentence_hash, sentences, document_id)
+                SELECT sentence_hash, sentences, document_id FROM stage_sentences
+                -- the same lock order on the unique index in every node, concurrent batches do not deadlock
+                ORDER BY sentence_hash
+                ON CONFLICT (sentence_hash) DO NOTHING
+                RETURNING sentence_hash, id
+                """)
+            new_ids = dict(curr.fetchall())
+            inserted = len(new_ids)
+            hash_ids.update(new_ids)
+            # sentences committed by another node since the lookup, the next statement sees them
+            missing = [h for h in new_sentences['sentence_hash'].tolist() if h not in hash_ids]
+            hash_ids.update(lookup_sentence_ids(curr, missing, schema_name))
+        relationships_start = time.perf_counter()
+
+        relationships = df[['bib_id', 'sentences', '1st_keyword', '2nd_keyword', 'category']].copy()
+        relationships['bib_id'] = relationships['bib_id'].astype('int64')
+        relationships['sentences'] = relationships['sentences'].map(hashes).map(hash_ids).astype('int64')
+        relationships['category'] = relationships['category'].astype(str)
+        _copy_df(curr, relationships, f'{schema_name}.relationships',
+                 ['document_id', 'sentence_id', 'keyword1', 'keyword2', 'category'])
+        if document_ids is not None:
+            mark_documents_done(curr, document_ids, schema_name=schema_name)
+        conn.commit()
+        cache.put_many(hash_ids)
+        # the sentences and relationships are committed together, the commit is counted to the relationships
+        metrics.observe('insert_sentences', relationships_start - sentences_start)
+        metrics.observe('insert_relationships', time.perf_counter() - relationships_start)
+        metrics.inc('inserted_rows', inserted + len(relationships))
+        metrics.inc('sentence_cache_hits', cached)
+        metrics.inc('sentences_deduplicated', len(hashes) - inserted)
+    except Exception as e:
+        print(f"Bulk insert failed, falling back to row by row insert: {e}")
+        conn.rollback()
+        start_time = time.time()
+        counter = insert_data(df, conn, schema_name=schema_name, document_ids=document_ids)
+    else:
+        counter = len(relationships)
+
+    elapsed_time = max(time.time() - start_time, 1e-9)
+    rows = counter + len(df['sentences'].unique())
+    print(f"Inserted {rows} rows in {elapsed_time:.2f}s ({rows / elapsed_time:.0f} rows/s)")
+    return counter
 
 def add_sentence_and_relationships_tables_for_thread(conn, number_of_thread=None):
     if number_of_thread is None:
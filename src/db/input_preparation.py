@@ -1,5 +1,9 @@
 import itertools
 import pandas as pd
+from src.db.progress_ledger import progress_condition
+
+# columns of the documents table used by the pipeline
+DOCUMENT_COLUMNS = ['id', 'file_location', 'doi', 'url', 'year', 'author', 'title', 'journal']
 
 
 def excel2pandas(file_name):
@@ -11,16 +15,94 @@ def excel2pandas(file_name):
     return k_words
 
 
-def sql2df(query, db):
+def sql2df(query, db, params=None):
     """
     Loading data from the database to the pandas dataframe
     The correct SQL statement should be defined with the specific table from the db
     returns: pandas.DataFrame: A new dataframe with the cleaned "keywords" column.
     """
-    df = pd.read_sql_query(query, db)
+    df = pd.read_sql_query(query, db, params=params)
     return df
 
 
+def iter_document_id_ranges(conn, schema_name='', batch_size=10, start_id=0, max_id=None, mode='all'):
+    """
+    Pages through the documents table by id (keyset pagination) instead of LIMIT/OFFSET,
+    every page is an index range scan no matter how far in the table it is.
+    mode selects the documents with regard to the progress ledger: 'all', 'pending' or 'failed'.
+    returns: generator of (first_id, last_id) tuples, both inclusive, each covering at most batch_size documents
+    """
+    curr = conn.cursor()
+    condition = progress_condition(schema_name, mode)
+    last_id = start_id - 1
+    while True:
+        if max_id is None:
+            curr.execute(f"""SELECT d.id FROM {schema_name}.documents d WHERE d.id > %s AND {condition}
+                             ORDER BY d.id LIMIT %s""", (last_id, batch_size))
+        else:
+            curr.execute(f"""SELECT d.id FROM {schema_name}.documents d WHERE d.id > %s AND d.id <= %s
+                             AND {condition} ORDER BY d.id LIMIT %s""", (last_id, max_id, batch_size))
+        ids = [row[0] for row in curr.fetchall()]
+        conn.commit()
+        if not ids:
+            break
+        last_id = ids[-1]
+        yield ids[0], last_id
+    curr.close()
+
+
+def iter_document_id_ranges_by_cost(conn, cost, schema_name='', max_cost=None, batch_size=10, start_id=0,
+                                    max_id=None, mode='all', page_size=1000):
+    """
+    Same as iter_document_id_ranges, but the ranges are sized by the estimated cost of their documents:
+    cost(file_location) is evaluated for every document (e.g. the size of its text file) and a range is closed
+    before its cost would exceed max_cost or it would hold more than batch_size documents.
+    A huge document is therefore processed alone, while small ones are still batched together.
+    returns: generator of (first_id, last_id) tuples, both inclusive
+    """
+    curr = conn.cursor()
+    condition = progress_condition(schema_name, mode)
+    last_id = start_id - 1
+    first_id = prev_id = None
+    count = total = 0
+    while True:
+        if max_id is None:
+            curr.execute(f"""SELECT d.id, d.file_location FROM {schema_name}.documents d WHERE d.id > %s
+                             AND {condition} ORDER BY d.id LIMIT %s""", (last_id, page_size))
+        else:
+            curr.execute(f"""SELECT d.id, d.file_location FROM {schema_name}.documents d WHERE d.id > %s
+                             AND d.id <= %s AND {condition} ORDER BY d.id LIMIT %s""", (last_id, max_id, page_size))
+        rows = curr.fetchall()
+        conn.commit()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        for doc_id, file_location in rows:
+            doc_cost = cost(file_location)
+            if first_id is not None and (count >= batch_size or (max_cost is not None and total + doc_cost > max_cost)):
+                yield first_id, prev_id
+                first_id = None
+            if first_id is None:
+                first_id, count, total = doc_id, 0, 0
+            count += 1
+            total += doc_cost
+            prev_id = doc_id
+    if first_id is not None:
+        yield first_id, prev_id
+    curr.close()
+
+
+def select_documents(conn, first_id, last_id, schema_name='', cols=None, mode='all'):
+    """
+    Loads the documents with ids in the range [first_id, last_id], only with the columns used by the pipeline
+    returns: pandas.DataFrame ordered by id
+    """
+    cols = DOCUMENT_COLUMNS if cols is None else cols
+    query = f"""SELECT {', '.join('d.' + col for col in cols)} FROM {schema_name}.documents d
+                WHERE d.id BETWEEN %s AND %s AND {progress_condition(schema_name, mode)} ORDER BY d.id"""
+    return sql2df(query=query, db=conn, params=(first_id, last_id))
+
+
 def clean_keywords(df, col):
     """
     Cleans the "keywords" column in a pandas dataframe by trimming whitespace from the strings,
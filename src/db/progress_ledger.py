@@ -0,0 +1,66 @@
+from psycopg2.extras import execute_values
+
+# documents selected in the given mode, condition on the documents table aliased as d
+_MODE_CONDITIONS = {
+    'all': "TRUE",
+    'pending': "NOT EXISTS (SELECT 1 FROM {schema}.document_progress p WHERE p.document_id = d.id "
+               "AND p.status = 'done')",
+    'failed': "EXISTS (SELECT 1 FROM {schema}.document_progress p WHERE p.document_id = d.id "
+              "AND p.status = 'failed')",
+}
+
+
+def add_progress_table(conn, schema_name=''):
+    """
+    Creates the ledger of processed documents: one row per documents.id with the status 'done' or 'failed'
+    """
+    curr = conn.cursor()
+    curr.execute(f"""CREATE TABLE IF NOT EXISTS {schema_name}.document_progress (
+        document_id INTEGER PRIMARY KEY,
+        status varchar(16) not null,
+        error text null,
+        updated_at timestamp not null default now()
+    );""")
+    conn.commit()
+    curr.close()
+
+
+def progress_condition(schema_name='', mode='all'):
+    """
+    SQL condition selecting the documents (alias d) in one of the modes:
+    'all', 'pending' (not done yet) or 'failed' (failed in an earlier run)
+    returns: SQL string
+    """
+    if mode not in _MODE_CONDITIONS:
+        raise ValueError(f"Unknown document selection mode {mode}, expected one of {list(_MODE_CONDITIONS)}")
+    return _MODE_CONDITIONS[mode].format(schema=schema_name)
+
+
+def mark_documents_done(curr, document_ids, schema_name=''):
+    """
+    Records the documents as done. Nothing is committed, so the caller can commit it together with
+    the inserted results of the same documents.
+    """
+    execute_values(curr, f"""
+        INSERT INTO {schema_name}.document_progress (document_id, status, error, updated_at)
+        VALUES %s
+        ON CONFLICT (document_id) DO UPDATE
+        SET status = EXCLUDED.status, error = NULL, updated_at = now()
+        """, [(int(document_id), 'done', None) for document_id in document_ids],
+                   template="(%s, %s, %s, now())")
+
+
+def mark_range_failed(conn, first_id, last_id, error, schema_name=''):
+    """
+    Records all the not yet done documents with ids in [first_id, last_id] as failed and commits
+    """
+    curr = conn.cursor()
+    curr.execute(f"""
+        INSERT INTO {schema_name}.document_progress (document_id, status, error, updated_at)
+        SELECT d.id, 'failed', %s, now() FROM {schema_name}.documents d WHERE d.id BETWEEN %s AND %s
+        ON CONFLICT (document_id) DO UPDATE
+        SET status = 'failed', error = EXCLUDED.error, updated_at = now()
+        WHERE {schema_name}.document_progress.status <> 'done'
+        """, (str(error), first_id, last_id))
+    conn.commit()
+    curr.close()
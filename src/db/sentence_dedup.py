@@ -0,0 +1,140 @@
+import os
+import threading
+from collections import OrderedDict
+
+from src.utils.hashing import sentence_hash
+
+# hash -> sentences.id pairs kept in memory by every process
+SENTENCE_CACHE_SIZE = 1_000_000
+
+
+def add_sentence_hash_column(conn, schema_name=''):
+    """
+    Migration of the sentences table: a sentence_hash column (128 bit hash of the text) with a unique index, so every
+    distinct sentence is stored once across batches and nodes.
+    Sentences inserted before the migration have no hash until backfill_sentence_hashes is run.
+    The catalog is checked first: the DDL takes its table lock before it checks IF NOT EXISTS, so a node starting
+    up would wait behind the insert transactions of the other nodes and block all the later ones.
+    """
+    curr = conn.cursor()
+    curr.execute("""SELECT 1 FROM information_schema.columns
+                    WHERE table_schema = %s AND table_name = 'sentences' AND column_name = 'sentence_hash'""",
+                 (schema_name,))
+    if curr.fetchone() is None:
+        curr.execute(f"ALTER TABLE {schema_name}.sentences ADD COLUMN IF NOT EXISTS sentence_hash uuid NULL")
+    curr.execute("SELECT 1 FROM pg_indexes WHERE schemaname = %s AND indexname = 'sentences_sentence_hash'",
+                 (schema_name,))
+    if curr.fetchone() is None:
+        curr.execute(f"""CREATE UNIQUE INDEX IF NOT EXISTS sentences_sentence_hash
+                         ON {schema_name}.sentences (sentence_hash)""")
+    conn.commit()
+    curr.close()
+
+
+def backfill_sentence_hashes(conn, schema_name='', page_size=10000):
+    """
+    Hashes the sentences inserted before the migration, page by page in id order. A sentence already stored
+    with a hash (an earlier copy) keeps its hash, the later copies stay without one and are not reused.
+    returns: number of hashed sentences
+    """
+    curr = conn.cursor()
+    last_id, hashed = 0, 0
+    while True:
+        curr.execute(f"""SELECT id, sentences FROM {schema_name}.sentences
+                         WHERE sentence_hash IS NULL AND id > %s ORDER BY id LIMIT %s""", (last_id, page_size))
+        rows = curr.fetchall()
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        # first copy of every sentence of the page
+        page = {}
+        for sentence_id, sentence in rows:
+            page.setdefault(sentence_hash(sentence or ''), sentence_id)
+        curr.execute(f"""UPDATE {schema_name}.sentences s SET sentence_hash = v.sentence_hash
+                         FROM unnest(%s::bigint[], %s::uuid[]) AS v (id, sentence_hash)
+                         WHERE s.id = v.id AND NOT EXISTS (SELECT 1 FROM {schema_name}.sentences e
+                                                           WHERE e.sentence_hash = v.sentence_hash)""",
+                     (list(page.values()), list(page.keys())))
+        hashed += curr.rowcount
+        conn.commit()
+    curr.close()
+    return hashed
+
+
+class SentenceIdCache:
+    """
+    Least recently used sentence_hash -> sentences.id pairs of the committed sentences, shared by the insertion
+    threads of the process: a sentence seen recently is resolved without a database round trip
+    """
+
+    def __init__(self, max_entries=SENTENCE_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, hashes):
+        """
+        returns: dict hash -> id of the cached hashes
+        """
+        found = {}
+        with self._lock:
+            for sentence_hash in hashes:
+                sentence_id = self._entries.get(sentence_hash)
+                if sentence_id is not None:
+                    self._entries.move_to_end(sentence_hash)
+                    found[sentence_hash] = sentence_id
+        return found
+
+    def put_many(self, mapping):
+        """
+        Stores committed hash -> id pairs, the least recently used ones are dropped beyond max_entries
+        """
+        with self._lock:
+            self._entries.update(mapping)
+            for sentence_hash in mapping:
+                self._entries.move_to_end(sentence_hash)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def sentence_id_cache(schema_name=''):
+    """
+    Cache of the process for the sentences table of the schema, SENTENCE_CACHE_SIZE entries (0 disables it)
+    returns: SentenceIdCache
+    """
+    with _caches_lock:
+        cache = _caches.get(schema_name)
+        if cache is None:
+            cache = _caches[schema_name] = SentenceIdCache(int(os.getenv('SENTENCE_CACHE_SIZE', SENTENCE_CACHE_SIZE)))
+        return cache
+
+
+def lookup_sentence_ids(curr, hashes, schema_name=''):
+    """
+    Bulk lookup of stored sentences by hash (one index scan per hash, one round trip)
+    returns: dict hash -> id of the stored hashes
+    """
+    if not hashes:
+        return {}
+    curr.execute(f"""SELECT sentence_hash, id FROM {schema_name}.sentences
+                     WHERE sentence_hash = ANY(%s::uuid[])""", (list(hashes),))
+    return dict(curr.fetchall())
+
+
+def sentence_hashes(sentences):
+    """
+    returns: dict sentence -> sentence_hash of the distinct sentences
+    """
+    return {sentence: sentence_hash(sentence) for sentence in dict.fromkeys(sentences)}
+
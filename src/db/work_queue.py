@@ -0,0 +1,186 @@
+import os
+import socket
+import threading
+import time
+
+# seconds a claimed batch stays reserved for its worker, the lease is renewed every third of it
+LEASE_SECONDS = 300
+# claims of a batch whose lease expired before it is given up as failed
+MAX_ATTEMPTS = 3
+# seconds between two claims while the other workers still hold the remaining batches
+POLL_INTERVAL = 5
+
+
+def worker_name():
+    """
+    returns: name of the current process in the work queue, unique across the nodes
+    """
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def add_jobs_table(conn, schema_name=''):
+    """
+    Creates the work queue shared by all the nodes: one row per batch of documents (range of documents.id)
+    with its status ('queued', 'running', 'done' or 'failed'), the worker holding it and the end of its lease.
+    Lease times are epoch seconds of the workers' clocks, which only have to agree within a fraction of the lease.
+    """
+    curr = conn.cursor()
+    curr.execute(f"""CREATE TABLE IF NOT EXISTS {schema_name}.analysis_jobs (
+        id SERIAL PRIMARY KEY,
+        first_id INTEGER not null,
+        last_id INTEGER not null,
+        status varchar(16) not null default 'queued',
+        worker varchar(255) null,
+        lease_until double precision null,
+        attempts INTEGER not null default 0,
+        error text null,
+        UNIQUE (first_id, last_id)
+    );""")
+    curr.execute(f"CREATE INDEX IF NOT EXISTS analysis_jobs_status ON {schema_name}.analysis_jobs (status, id)")
+    conn.commit()
+    curr.close()
+
+
+def enqueue_jobs(conn, id_ranges, schema_name=''):
+    """
+    Adds the batches to the work queue, batches already in the queue (in any status) are skipped,
+    so several nodes can enqueue the same ranges
+    returns: number of added batches
+    """
+    curr = conn.cursor()
+    added = 0
+    for first_id, last_id in id_ranges:
+        curr.execute(f"""INSERT INTO {schema_name}.analysis_jobs (first_id, last_id) VALUES (%s, %s)
+                         ON CONFLICT (first_id, last_id) DO NOTHING RETURNING id""", (first_id, last_id))
+        added += curr.fetchone() is not None
+    conn.commit()
+    curr.close()
+    return added
+
+
+def requeue_expired(conn, schema_name='', max_attempts=MAX_ATTEMPTS):
+    """
+    Returns the batches whose lease expired (the worker died or lost the database) to the queue,
+    a batch which already used max_attempts claims is marked as failed instead
+    returns: number of requeued or failed batches
+    """
+    curr = conn.cursor()
+    curr.execute(f"""UPDATE {schema_name}.analysis_jobs
+                     SET status = CASE WHEN attempts >= %s THEN 'failed' ELSE 'queued' END,
+                         error = CASE WHEN attempts >= %s THEN 'lease expired' ELSE error END,
+                         worker = NULL, lease_until = NULL
+                     WHERE status = 'running' AND lease_until < %s RETURNING id""",
+                 (max_attempts, max_attempts, time.time()))
+    count = len(curr.fetchall())
+    conn.commit()
+    curr.close()
+    return count
+
+
+def claim_job(conn, worker, schema_name='', lease_seconds=LEASE_SECONDS):
+    """
+    Claims the first queued batch for the worker. Rows locked by the claims of other workers are skipped
+    (FOR UPDATE SKIP LOCKED), so concurrent workers never wait for each other nor get the same batch.
+    returns: (first_id, last_id) or None when nothing is queued
+    """
+    curr = conn.cursor()
+    curr.execute(f"""UPDATE {schema_name}.analysis_jobs
+                     SET status = 'running', worker = %s, lease_until = %s, attempts = attempts + 1
+                     WHERE id = (SELECT id FROM {schema_name}.analysis_jobs WHERE status = 'queued'
+                                 ORDER BY id LIMIT 1 FOR UPDATE SKIP LOCKED)
+                     RETURNING first_id, last_id""", (worker, time.time() + lease_seconds))
+    row = curr.fetchone()
+    conn.commit()
+    curr.close()
+    return tuple(row) if row else None
+
+
+def renew_leases(conn, worker, schema_name='', lease_seconds=LEASE_SECONDS):
+    """
+    Heartbeat: extends the leases of all the batches held by the worker
+    returns: number of renewed leases
+    """
+    curr = conn.cursor()
+    curr.execute(f"""UPDATE {schema_name}.analysis_jobs SET lease_until = %s
+                     WHERE worker = %s AND status = 'running' RETURNING id""", (time.time() + lease_seconds, worker))
+    count = len(curr.fetchall())
+    conn.commit()
+    curr.close()
+    return count
+
+
+def finish_job(conn, id_range, worker, schema_name='', error=None):
+    """
+    Marks the batch held by the worker as done, or as failed with the error
+    returns: False when the worker does not hold the batch anymore (its lease expired and it was requeued)
+    """
+    curr = conn.cursor()
+    curr.execute(f"""UPDATE {schema_name}.analysis_jobs SET status = %s, error = %s, lease_until = NULL
+                     WHERE first_id = %s AND last_id = %s AND worker = %s AND status = 'running' RETURNING id""",
+                 ('done' if error is None else 'failed', None if error is None else str(error)[:1000],
+                  id_range[0], id_range[1], worker))
+    found = curr.fetchone() is not None
+    conn.commit()
+    curr.close()
+    return found
+
+
+def open_jobs(conn, schema_name=''):
+    """
+    returns: number of queued and running batches
+    """
+    curr = conn.cursor()
+    curr.execute(f"SELECT COUNT(*) FROM {schema_name}.analysis_jobs WHERE status IN ('queued', 'running')")
+    count = curr.fetchone()[0]
+    conn.commit()
+    curr.close()
+    return count
+
+
+def iter_claimed_jobs(conn, worker, schema_name='', lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                      poll_interval=POLL_INTERVAL):
+    """
+    Claims batches one by one, as the consumer asks for them. When nothing is queued but other workers
+    still hold batches, it waits for their leases to expire (or the batches to finish) and claims the requeued ones.
+    returns: generator of (first_id, last_id) tuples, ends when all the batches are done or failed
+    """
+    while True:
+        requeue_expired(conn, schema_name, max_attempts)
+        id_range = claim_job(conn, worker, schema_name, lease_seconds)
+        if id_range is not None:
+            yield id_range
+            continue
+        if not open_jobs(conn, schema_name):
+            return
+        time.sleep(poll_interval)
+
+
+class LeaseKeeper:
+    """
+    Background thread renewing the leases of the worker every lease_seconds / 3 on its own connection,
+    so the batches waiting in the queues of the pipeline are not taken over by other nodes while the worker is alive
+    """
+
+    def __init__(self, conn, worker, schema_name='', lease_seconds=LEASE_SECONDS):
+        self.conn = conn
+        self.worker = worker
+        self.schema_name = schema_name
+        self.lease_seconds = lease_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='lease-keeper', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            try:
+                renew_leases(self.conn, self.worker, self.schema_name, self.lease_seconds)
+            except Exception as e:
+                print(f"Lease renewal failed: {e}")
+                self.conn.rollback()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
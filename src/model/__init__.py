@@ -1 +1,3 @@
-from src.model.bert_prediction import *
\ No newline at end of file
+from src.model.bert_prediction import *
+from src.model.inference_cache import *
+from src.model.backends import *
\ No newline at end of file
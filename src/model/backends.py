@@ -0,0 +1,142 @@
+import os
+import tempfile
+
+import torch
+
+import src.model.bert_prediction as bp
+from src.model.inference_cache import model_fingerprint
+
+BACKENDS = ('pytorch', 'pytorch-int8', 'onnx')
+
+ONNX_INPUTS = ('input_ids', 'attention_mask', 'token_type_ids')
+
+
+class _Output:
+    def __init__(self, logits):
+        self.logits = logits
+
+
+class OnnxBertModel:
+    """
+    ONNX Runtime session behaving like BertForSequenceClassification for apply_BERT_model:
+    it is called with the tokenizer output and returns an object with the logits tensor.
+    """
+    # the inputs are fed from the CPU
+    device = torch.device('cpu')
+
+    def __init__(self, onnx_path, num_threads=None):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, sess_options=options, providers=['CPUExecutionProvider'])
+        self.input_names = [session_input.name for session_input in self.session.get_inputs()]
+
+    def __call__(self, **inputs):
+        feed = {name: inputs[name].cpu().numpy().astype('int64') for name in self.input_names if name in inputs}
+        logits = self.session.run(['logits'], feed)[0]
+        return _Output(torch.from_numpy(logits))
+
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+
+def quantize_model(model):
+    """
+    Dynamic int8 quantization of the Linear layers (weights int8, activations quantized on the fly), CPU only:
+    the inputs follow model.device, which is the CPU for the quantized model
+    returns: quantized copy of the model
+    """
+    return torch.quantization.quantize_dynamic(model.to('cpu'), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def export_onnx(model, tokenizer, onnx_path, max_seq_length=128):
+    """
+    Exports the classifier to ONNX with dynamic batch and sequence axes (TorchScript exporter, needs the onnx
+    package). The file is written under a temporary name and renamed, so a crash or a concurrent export never
+    leaves a partial file at onnx_path.
+    returns: onnx_path
+    """
+    model = model.to('cpu').eval()
+    dummy = tokenizer(['export'], padding='max_length', truncation=True, max_length=max_seq_length,
+                      return_tensors='pt')
+    input_names = [name for name in ONNX_INPUTS if name in dummy]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['logits'] = {0: 'batch'}
+    directory = os.path.dirname(os.path.abspath(onnx_path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.export-', suffix='.onnx', dir=directory)
+    os.close(fd)
+    try:
+        with torch.no_grad():
+            # the dynamo exporter (default since torch 2.9) would need onnxscript
+            torch.onnx.export(model, tuple(dummy[name] for name in input_names), tmp_path,
+                              input_names=input_names, output_names=['logits'],
+                              dynamic_axes=dynamic_axes, opset_version=14, dynamo=False)
+        os.replace(tmp_path, onnx_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return onnx_path
+
+
+def _write_atomic(path, text):
+    fd, tmp_path = tempfile.mkstemp(prefix='.', dir=os.path.dirname(os.path.abspath(path)))
+    with os.fdopen(fd, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def exported_onnx(model, tokenizer, model_path, onnx_path):
+    """
+    ONNX export of the model at model_path, exported again when the model changed: the fingerprint of the model
+    directory is kept in <onnx_path>.fingerprint next to the export
+    returns: onnx_path
+    """
+    fingerprint = model_fingerprint(model_path)
+    fingerprint_path = onnx_path + '.fingerprint'
+    try:
+        with open(fingerprint_path) as f:
+            current = os.path.exists(onnx_path) and f.read() == fingerprint
+    except FileNotFoundError:
+        current = False
+    if not current:
+        export_onnx(model, tokenizer, onnx_path)
+        _write_atomic(fingerprint_path, fingerprint)
+    return onnx_path
+
+
+def load_model_and_tokenizer(model_path, num_of_labels, backend='pytorch', onnx_path=None):
+    """
+    Loads the fine-tuned model for the chosen inference backend:
+    'pytorch' (FP32), 'pytorch-int8' (dynamically quantized, CPU) or 'onnx' (ONNX Runtime, exported on the first
+    use and again whenever the model changes).
+    Every backend can be passed as the model to apply_BERT_model and predicts labels of LABEL_MAP.
+    returns: model, tokenizer
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend}, expected one of {BACKENDS}")
+    model, tokenizer = bp.load_model_and_tokenizer(model_path, num_of_labels)
+    if backend == 'pytorch-int8':
+        model = quantize_model(model)
+    elif backend == 'onnx':
+        onnx_path = onnx_path or model_path.rstrip('/\\') + '.onnx'
+        model = OnnxBertModel(exported_onnx(model, tokenizer, model_path, onnx_path))
+    return model, tokenizer
+
+
+def accuracy_parity(df, input_col, reference_model, model, tokenizer, **kwargs):
+    """
+    Compares the labels predicted by a backend with the labels of the reference (FP32) model
+    returns: share of rows with the same label
+    """
+    reference = bp.apply_BERT_model(df=df.copy(), input_col=input_col, pred_col='category',
+                                    model=reference_model, tokenizer=tokenizer, **kwargs)['category']
+    candidate = bp.apply_BERT_model(df=df.copy(), input_col=input_col, pred_col='category',
+                                    model=model, tokenizer=tokenizer, **kwargs)['category']
+    if len(reference) == 0:
+        return 1.0
+    return float((reference.values == candidate.values).mean())
@@ -1,9 +1,20 @@
+import numpy as np
 import pandas as pd
 import torch
-from transformers import BertForSequenceClassification, BertTokenizerFast
+from transformers import BatchEncoding, BertForSequenceClassification, BertTokenizerFast
+
+import src.utils.metrics as metrics
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+# Map the labels to the corresponding string values
+LABEL_MAP = {
+    0: "NEGATIVE IMPACT",
+    1: "NO IMPACT",
+    2: "POSITIVE IMPACT",
+    3: "NO INFO ABOUT RELATION",
+}
+
 
 def load_model_and_tokenizer(model_path, num_of_labels):
     model = BertForSequenceClassification.from_pretrained(model_path, num_labels=num_of_labels)
@@ -15,13 +26,61 @@ def load_model_and_tokenizer(model_path, num_of_labels):
 
     return model, tokenizer
 
+def length_bucketed_batches(lengths, max_tokens, max_rows):
+    """
+    Groups the inputs by tokenized length so that the padded size of every batch (rows * longest row)
+    stays within the token budget. Inputs are visited from the shortest to the longest one,
+    so the rows of a batch have similar lengths and little of the budget is spent on padding.
+    returns: list of lists of indices into lengths
+    """
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    batches = []
+    batch = []
+    for idx in order:
+        # lengths are ascending, the current row is the longest one of the batch
+        if batch and ((len(batch) + 1) * lengths[idx] > max_tokens or len(batch) >= max_rows):
+            batches.append(batch)
+            batch = []
+        batch.append(idx)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _predict_labels(inputs, model):
+    # the CPU only backends (int8, ONNX) keep their inputs on the CPU
+    inputs = inputs.to(getattr(model, 'device', device))
+    with torch.no_grad(), metrics.timer('forward_pass'):
+        outputs = model(**inputs)
+        logits = outputs.logits
+        labels = logits.argmax(dim=1).tolist()
+    metrics.inc('inference_rows', len(labels))
+    return labels
+
+
 def apply_BERT_model(df, input_col, pred_col, model, tokenizer,
-                     batch_size=32, max_seq_length=128):
+                     batch_size=32, max_seq_length=128, max_tokens=None):
     """
     Apply a fine-tuned BERT model to a DataFrame column of text and classify each row based on the model's prediction.
     Load the fine-tuned model's weights and configuration, create the classifier, apply the function to the 'text_column'
+    With max_tokens the rows are bucketed by tokenized length and batched under a budget of max_tokens padded tokens
+    (and at most batch_size rows) instead of fixed slices in arrival order; the predictions keep the original order.
     returns: pandas.DataFrame: The df with the specified text column replaced by the predicted labels for each row.
     """
+    if max_tokens is not None:
+        texts = df[input_col].tolist()
+        with metrics.timer('tokenization'):
+            encodings = tokenizer(texts, truncation=True, max_length=max_seq_length)
+        lengths = [len(ids) for ids in encodings['input_ids']]
+        labels = [None] * len(texts)
+        for batch in length_bucketed_batches(lengths, max_tokens, batch_size):
+            features = [{key: encodings[key][idx] for key in encodings.keys()} for idx in batch]
+            with metrics.timer('tokenization'):
+                inputs = tokenizer.pad(features, padding=True, return_tensors="pt")
+            for idx, label in zip(batch, _predict_labels(inputs, model)):
+                labels[idx] = label
+        df[pred_col] = pd.Series([LABEL_MAP.get(label) for label in labels], dtype='category').tolist()
+        return df
 
     # Split the DataFrame into batches
     batches = [df[i:i + batch_size] for i in range(0, len(df), batch_size)]
@@ -32,22 +91,64 @@ def apply_BERT_model(df, input_col, pred_col, model, tokenizer,
         # print('Assigning category for this input:  ', input_col)
 
         texts = batch[input_col].tolist()
-        inputs = tokenizer(texts, padding=True, truncation=True, max_length=max_seq_length, return_tensors="pt")
-        inputs = inputs.to(device)
-        with torch.no_grad():
-            outputs = model(**inputs)
-            logits = outputs.logits
-            labels = logits.argmax(dim=1).tolist()
-
-        # Map the labels to the corresponding string values
-        LABEL_MAP = {
-            0: "NEGATIVE IMPACT",
-            1: "NO IMPACT",
-            2: "POSITIVE IMPACT",
-            3: "NO INFO ABOUT RELATION",
-        }
+        with metrics.timer('tokenization'):
+            inputs = tokenizer(texts, padding=True, truncation=True, max_length=max_seq_length, return_tensors="pt")
+        labels = _predict_labels(inputs, model)
+
         for label in labels:
             results.append(LABEL_MAP.get(label))
     df[pred_col] = pd.Series(results, dtype='category').tolist()
 
     return df
+
+
+def pad_encoded(lengths, offsets, ids, rows, pad_token_id=0):
+    """
+    Builds the padded model inputs of the given rows of EncodedInputs arrays,
+    the same tensors the tokenizer returns with padding=True
+    returns: BatchEncoding with input_ids, token_type_ids and attention_mask
+    """
+    row_lengths = lengths[rows].astype(np.int64)
+    attention_mask = np.arange(row_lengths.max()) < row_lengths[:, None]
+    # position of every token of the rows in ids, in row order
+    starts = offsets[rows] - (np.cumsum(row_lengths) - row_lengths)
+    gather = np.repeat(starts, row_lengths) + np.arange(row_lengths.sum())
+    input_ids = np.full(attention_mask.shape, pad_token_id, dtype=np.int64)
+    input_ids[attention_mask] = ids[gather]
+    return BatchEncoding({'input_ids': torch.from_numpy(input_ids),
+                          'token_type_ids': torch.zeros(input_ids.shape, dtype=torch.int64),
+                          'attention_mask': torch.from_numpy(attention_mask.astype(np.int64))})
+
+
+def predict_encoded(encoded, model, rows=None, batch_size=32, max_tokens=None):
+    """
+    Classifies the rows of EncodedInputs tokenized by the preprocessing workers, only the forward passes run here.
+    Batching is the same as in apply_BERT_model: fixed slices of batch_size rows or, with max_tokens,
+    length-bucketed batches under the token budget.
+    returns: list of labels of LABEL_MAP, one per row (all the rows when rows is None)
+    """
+    lengths, offsets, ids = encoded.arrays()
+    rows = np.arange(len(lengths)) if rows is None else np.asarray(rows, dtype=np.int64)
+    if max_tokens is not None:
+        batches = length_bucketed_batches(lengths[rows].tolist(), max_tokens, batch_size)
+    else:
+        batches = [range(i, min(i + batch_size, len(rows))) for i in range(0, len(rows), batch_size)]
+
+    labels = [None] * len(rows)
+    for batch in batches:
+        batch = np.asarray(batch, dtype=np.int64)
+        with metrics.timer('tokenization'):
+            inputs = pad_encoded(lengths, offsets, ids, rows[batch], encoded.pad_token_id)
+        for idx, label in zip(batch.tolist(), _predict_labels(inputs, model)):
+            labels[idx] = LABEL_MAP.get(label)
+    return labels
+
+
+def apply_BERT_model_encoded(df, encoded, pred_col, model, batch_size=32, max_tokens=None):
+    """
+    Same as apply_BERT_model, for rows already tokenized into EncodedInputs (one row of encoded per row of df)
+    returns: pandas.DataFrame with the predicted labels in pred_col
+    """
+    labels = predict_encoded(encoded, model, batch_size=batch_size, max_tokens=max_tokens)
+    df[pred_col] = pd.Series(labels, dtype='category').tolist()
+    return df
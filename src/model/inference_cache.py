@@ -0,0 +1,160 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import src.model.bert_prediction as bp
+
+
+def model_fingerprint(model_path):
+    """
+    Fingerprint of the model directory built from the names, sizes and modification times of its files,
+    so replacing the weights or the config changes it without hashing gigabytes of weights
+    returns: hex string
+    """
+    digest = hashlib.sha256()
+    for root, _, files in sorted(os.walk(model_path)):
+        for name in sorted(files):
+            stat = os.stat(os.path.join(root, name))
+            digest.update(f'{os.path.relpath(os.path.join(root, name), model_path)}:{stat.st_size}:'
+                          f'{stat.st_mtime_ns};'.encode())
+    return digest.hexdigest()
+
+
+def input_key(text):
+    """
+    Content hash of one model input
+    returns: hex string
+    """
+    return hashlib.sha1(text.encode('utf-8', errors='ignore')).hexdigest()
+
+
+def encoded_keys(encoded):
+    """
+    Content hashes of the token ids of every row of EncodedInputs, prefixed so they never collide with input_key
+    returns: list of strings
+    """
+    lengths, offsets, ids = encoded.arrays()
+    return ['ids:' + hashlib.sha1(ids[start:start + length].tobytes()).hexdigest()
+            for start, length in zip(offsets.tolist(), lengths.tolist())]
+
+
+class PredictionCache:
+    """
+    On-disk (SQLite) cache of predicted categories keyed by the content hash of the model input.
+    The cache is bound to a model fingerprint and is emptied when the fingerprint changes.
+    It holds at most max_entries predictions, the least recently used ones are evicted first.
+    """
+    # share of max_entries freed by an eviction, so the table is counted again only after that many puts
+    EVICTION_HEADROOM = 0.1
+
+    def __init__(self, path, fingerprint, max_entries=1_000_000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS predictions (
+            key TEXT PRIMARY KEY,
+            label TEXT,
+            last_used REAL
+        )""")
+        self._conn.execute('CREATE INDEX IF NOT EXISTS predictions_last_used ON predictions (last_used)')
+        row = self._conn.execute("SELECT value FROM meta WHERE key = 'model_fingerprint'").fetchone()
+        if row is None or row[0] != fingerprint:
+            self._conn.execute('DELETE FROM predictions')
+            self._conn.execute("INSERT OR REPLACE INTO meta VALUES ('model_fingerprint', ?)", (fingerprint,))
+        self._conn.commit()
+        # upper bound of the number of entries, replaced keys are counted as new ones
+        self._size_bound = self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+
+    def get_many(self, keys):
+        """
+        Looks up the keys and marks the found ones as recently used
+        returns: dict key -> label
+        """
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                chunk = keys[i:i + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, label FROM predictions WHERE key IN ({', '.join('?' * len(chunk))})", chunk)
+                found.update(rows.fetchall())
+            now = time.time()
+            self._conn.executemany('UPDATE predictions SET last_used = ? WHERE key = ?',
+                                   [(now, key) for key in found])
+            self._conn.commit()
+        return found
+
+    def put_many(self, items):
+        """
+        Stores key -> label pairs. The table is counted only when the running bound of its size exceeds max_entries,
+        then the least recently used entries are evicted down to max_entries minus the eviction headroom.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany('INSERT OR REPLACE INTO predictions VALUES (?, ?, ?)',
+                                   [(key, label, now) for key, label in items.items()])
+            self._size_bound += len(items)
+            if self._size_bound > self.max_entries:
+                # other processes may share the file, the exact size is counted before evicting
+                size = self._conn.execute('SELECT COUNT(*) FROM predictions').fetchone()[0]
+                excess = size - self.max_entries
+                if excess > 0:
+                    excess += int(self.max_entries * self.EVICTION_HEADROOM)
+                    self._conn.execute("""DELETE FROM predictions WHERE key IN (
+                        SELECT key FROM predictions ORDER BY last_used LIMIT ?)""", (excess,))
+                    size = max(size - excess, 0)
+                self._size_bound = size
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def apply_BERT_model_cached(df, input_col, pred_col, model, tokenizer, cache, **kwargs):
+    """
+    Same as apply_BERT_model, but identical inputs are classified only once per batch and
+    inputs already predicted in earlier batches or runs are taken from the cache.
+    returns: pandas.DataFrame with the predicted labels in pred_col
+    """
+    keys = df[input_col].map(input_key)
+    labels = cache.get_many(keys.unique())
+
+    missing = ~keys.isin(labels.keys())
+    if missing.any():
+        to_predict = pd.DataFrame({input_col: df.loc[missing, input_col].values, 'key': keys[missing].values}) \
+            .drop_duplicates(subset='key').reset_index(drop=True)
+        to_predict = bp.apply_BERT_model(df=to_predict, input_col=input_col, pred_col=pred_col,
+                                         model=model, tokenizer=tokenizer, **kwargs)
+        predicted = dict(zip(to_predict['key'], to_predict[pred_col]))
+        cache.put_many(predicted)
+        labels.update(predicted)
+
+    df[pred_col] = keys.map(labels).tolist()
+    return df
+
+
+def apply_BERT_model_encoded_cached(df, encoded, pred_col, model, cache, **kwargs):
+    """
+    Same as apply_BERT_model_cached, for rows already tokenized into EncodedInputs; the cache is keyed by the token ids
+    returns: pandas.DataFrame with the predicted labels in pred_col
+    """
+    keys = pd.Series(encoded_keys(encoded), index=df.index, dtype=object)
+    labels = cache.get_many(keys.unique())
+
+    missing = ~keys.isin(labels.keys())
+    if missing.any():
+        rows = np.flatnonzero((missing & ~keys.duplicated()).to_numpy())
+        predicted = dict(zip(keys.iloc[rows], bp.predict_encoded(encoded, model, rows=rows, **kwargs)))
+        cache.put_many(predicted)
+        labels.update(predicted)
+
+    df[pred_col] = keys.map(labels).tolist()
+    return df
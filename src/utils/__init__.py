@@ -2,4 +2,12 @@ from src.utils.result_preparation import *
 from src.utils.keywords_detection import *
 from src.utils.keywords_preparation import *
 from src.utils.text_postprocessing import *
-from src.utils.text_preprocessing import *
\ No newline at end of file
+from src.utils.text_preprocessing import *
+from src.utils.keyword_matcher import *
+from src.utils.pipeline import *
+from src.utils.keyword_dictionary import *
+from src.utils.metrics import *
+from src.utils.bert_inputs import *
+from src.utils.keyword_prefilter import *
+from src.utils.parquet_sink import *
+from src.utils.hashing import *
\ No newline at end of file
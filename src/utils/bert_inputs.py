@@ -0,0 +1,109 @@
+import itertools
+import os
+import tempfile
+
+import numpy as np
+
+_tokenizers = {}
+
+
+def bert_input_texts(df):
+    """
+    Model input of every relation: the sentence and both keywords joined by '.'
+    returns: pandas Series of str
+    """
+    return df['sentences'].astype(str) + '.' + df['1st_keyword'].astype(str) + '.' + df['2nd_keyword'].astype(str)
+
+
+def get_tokenizer(model_path):
+    """
+    Tokenizer of the model, loaded once per process (transformers is imported on the first call only)
+    returns: BertTokenizerFast
+    """
+    tokenizer = _tokenizers.get(model_path)
+    if tokenizer is None:
+        from transformers import BertTokenizerFast
+        tokenizer = _tokenizers[model_path] = BertTokenizerFast.from_pretrained(model_path)
+    return tokenizer
+
+
+def _inputs_dir():
+    # /dev/shm keeps the hand-off files in shared memory on linux
+    directory = os.getenv('BERT_INPUTS_DIR')
+    if directory:
+        return directory
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def create_inputs_dir():
+    """
+    Directory for the hand-off files of one run in BERT_INPUTS_DIR (/dev/shm by default). The run removes it
+    at its end, so files of batches which never reached the inference stage do not stay in shared memory.
+    returns: path
+    """
+    return tempfile.mkdtemp(prefix='bert_inputs_run_', dir=_inputs_dir())
+
+
+class EncodedInputs:
+    """
+    Tokenized model inputs of one batch stored in a memory-mapped file: the int32 lengths of the rows
+    followed by their int32 input ids without padding. Only the path and the sizes are pickled, so a worker process
+    hands a batch over to the inference stage without sending the texts or the token lists.
+    The attention mask is not stored, every token of a row is attended, it follows from the lengths.
+    """
+
+    def __init__(self, path, num_rows, num_tokens, pad_token_id=0):
+        self.path = path
+        self.num_rows = num_rows
+        self.num_tokens = num_tokens
+        self.pad_token_id = pad_token_id
+
+    def __len__(self):
+        return self.num_rows
+
+    def arrays(self):
+        """
+        Maps the file into memory
+        returns: lengths, offsets of the rows into ids, ids (numpy arrays)
+        """
+        if not self.num_rows:
+            empty = np.zeros(0, dtype=np.int32)
+            return empty, np.zeros(0, dtype=np.int64), empty
+        data = np.memmap(self.path, dtype=np.int32, mode='r', shape=(self.num_rows + self.num_tokens,))
+        lengths = data[:self.num_rows]
+        offsets = np.zeros(self.num_rows, dtype=np.int64)
+        np.cumsum(lengths[:-1], out=offsets[1:])
+        return lengths, offsets, data[self.num_rows:]
+
+    def release(self):
+        """
+        Removes the file, the arrays already mapped stay readable until they are dropped
+        """
+        if self.path is not None:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+
+def encode_inputs(texts, tokenizer, max_seq_length=128, directory=None):
+    """
+    Tokenizes the texts (truncated to max_seq_length tokens, as in apply_BERT_model) and writes them to a file
+    in directory, BERT_INPUTS_DIR or /dev/shm by default
+    returns: EncodedInputs
+    """
+    if not len(texts):
+        return EncodedInputs(None, 0, 0, tokenizer.pad_token_id)
+    encodings = tokenizer(list(texts), truncation=True, max_length=max_seq_length,
+                          return_attention_mask=False, return_token_type_ids=False)
+    input_ids = encodings['input_ids']
+    lengths = np.fromiter(map(len, input_ids), dtype=np.int32, count=len(input_ids))
+    num_tokens = int(lengths.sum())
+    ids = np.fromiter(itertools.chain.from_iterable(input_ids), dtype=np.int32, count=num_tokens)
+
+    fd, path = tempfile.mkstemp(prefix='bert_inputs_', suffix='.i32', dir=directory or _inputs_dir())
+    with os.fdopen(fd, 'wb') as f:
+        lengths.tofile(f)
+        ids.tofile(f)
+    return EncodedInputs(path, len(lengths), num_tokens, tokenizer.pad_token_id)
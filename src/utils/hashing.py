@@ -0,0 +1,19 @@
+import hashlib
+import uuid
+
+
+def sentence_digest(sentence):
+    """
+    128 bit content hash of a sentence, the same on every node and in every run. Distinct sentences collide with a
+    probability of about n^2 / 2^129, so the hash is used as the identity of a sentence and the text is not compared.
+    returns: 16 bytes
+    """
+    return hashlib.blake2b(sentence.encode('utf-8', errors='surrogatepass'), digest_size=16).digest()
+
+
+def sentence_hash(sentence):
+    """
+    sentence_digest as the uuid of the sentences.sentence_hash column
+    returns: uuid string
+    """
+    return str(uuid.UUID(bytes=sentence_digest(sentence)))
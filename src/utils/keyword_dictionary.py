@@ -0,0 +1,96 @@
+import os
+import pickle
+import tempfile
+import time
+
+import src.db.input_preparation as ip
+from src.utils.keyword_matcher import build_keyword_matcher
+from src.utils.keyword_prefilter import build_keyword_prefilter
+from src.utils.text_postprocessing import KeywordIndex
+
+# how long a process trusts its keyword dictionary before probing the keywords table again
+VERSION_CHECK_INTERVAL = 60
+# bumped whenever KeywordDictionary changes, so stale pickles are not loaded
+DICTIONARY_FORMAT = 4
+
+_dictionaries = {}
+
+
+class KeywordDictionary:
+    """
+    Cleaned keywords table (name, normalized/general/displayed terms) together with the compiled keyword matcher,
+    its prefilter and the integer coded KeywordIndex, tagged with the version of the keywords table it was built from.
+    """
+
+    def __init__(self, keywords, version):
+        self.keywords = keywords
+        self.version = version
+        self.matcher = build_keyword_matcher(keywords['name'])
+        self.prefilter = build_keyword_prefilter(self.matcher.keywords)
+        self.index = KeywordIndex(keywords)
+        self.checked_at = time.monotonic()
+
+
+def keywords_version(conn, schema_name=''):
+    """
+    Cheap probe of the keywords table: row count and a checksum of all the rows, computed by the database
+    returns: version string, changes whenever a keyword is added, removed or edited
+    """
+    curr = conn.cursor()
+    curr.execute(f"""SELECT COUNT(*), md5(COALESCE(string_agg(md5(k::text), '' ORDER BY md5(k::text)), ''))
+                     FROM {schema_name}.keywords k""")
+    count, checksum = curr.fetchone()
+    curr.close()
+    conn.commit()
+    return f'{count}-{checksum}'
+
+
+def _cache_file(cache_dir, schema_name, version):
+    return os.path.join(cache_dir, f'keywords_v{DICTIONARY_FORMAT}_{schema_name or "public"}_{version}.pkl')
+
+
+def load_keyword_dictionary(conn, schema_name='', version=None, cache_dir=None):
+    """
+    Loads the keyword dictionary of the given version from the serialized file shared by all the workers,
+    the first process which needs it builds it from the database and writes the file.
+    returns: KeywordDictionary
+    """
+    version = version or keywords_version(conn, schema_name)
+    cache_dir = cache_dir or os.getenv('KEYWORD_CACHE_DIR') or os.path.join(tempfile.gettempdir(), 'keyword_cache')
+    path = _cache_file(cache_dir, schema_name, version)
+    try:
+        with open(path, 'rb') as f:
+            dictionary = pickle.load(f)
+        dictionary.checked_at = time.monotonic()
+        return dictionary
+    except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+        pass
+
+    keywords = ip.sql2df(query=f"SELECT * from {schema_name}.keywords", db=conn)
+    keywords = ip.clean_keywords(df=keywords, col='name')
+    dictionary = KeywordDictionary(keywords, version)
+
+    os.makedirs(cache_dir, exist_ok=True)
+    # write to a temporary file first, so other workers never read a half written dictionary
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    with os.fdopen(fd, 'wb') as f:
+        pickle.dump(dictionary, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    return dictionary
+
+
+def get_keyword_dictionary(conn, schema_name='', cache_dir=None, check_interval=VERSION_CHECK_INTERVAL):
+    """
+    Keyword dictionary of the current process. It is reused across batches and reloaded only when
+    the keywords table changes; the table is probed at most once per check_interval seconds.
+    returns: KeywordDictionary
+    """
+    dictionary = _dictionaries.get(schema_name)
+    if dictionary is not None and time.monotonic() - dictionary.checked_at < check_interval:
+        return dictionary
+    version = keywords_version(conn, schema_name)
+    if dictionary is None or dictionary.version != version:
+        dictionary = load_keyword_dictionary(conn, schema_name, version=version, cache_dir=cache_dir)
+        _dictionaries[schema_name] = dictionary
+    dictionary.checked_at = time.monotonic()
+    return dictionary
@@ -0,0 +1,147 @@
+from collections import deque
+
+
+def _is_word_char(char):
+    """
+    Mirrors the definition of a word character used by the regex ``\\b`` anchor
+    returns: bool
+    """
+    return char.isalnum() or char == '_'
+
+
+class KeywordMatcher:
+    """
+    Aho-Corasick automaton matching a whole keyword set in a single pass over a sentence.
+    A hit never cuts a word: a keyword starting (ending) with a word character must not be preceded (followed) by one.
+    For such keywords this equals ``\\b...\\b``. A keyword edge which is not a word character has no condition,
+    where ``\\b`` would require a word character next to it: '-' is found in 'b -cb aa', ``\\b-\\b`` finds nothing.
+    By default overlapping hits are resolved leftmost-longest, so 'lung cancer' wins over 'lung' and 'cancer'
+    at the same position.
+    The automaton only holds plain lists and dicts, so it pickles cheaply and can be shipped to joblib workers.
+    """
+
+    def __init__(self, keywords, overlapping=False):
+        self.overlapping = overlapping
+        self.keywords = []
+        # node -> {char: node}, failure link per node, (keyword_index, ...) ending at node incl. suffixes
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [()]
+
+        for keyword in dict.fromkeys(keywords):
+            if not isinstance(keyword, str) or not keyword:
+                continue
+            self._add(keyword)
+        self._build()
+
+    def __len__(self):
+        return len(self.keywords)
+
+    def __getstate__(self):
+        return {'overlapping': self.overlapping, 'keywords': self.keywords,
+                'goto': self._goto, 'fail': self._fail, 'out': self._out}
+
+    def __setstate__(self, state):
+        self.overlapping = state['overlapping']
+        self.keywords = state['keywords']
+        self._goto = state['goto']
+        self._fail = state['fail']
+        self._out = state['out']
+
+    def _add(self, keyword):
+        node = 0
+        for char in keyword:
+            nxt = self._goto[node].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append(())
+            node = nxt
+        self._out[node] = (len(self.keywords),)
+        self.keywords.append(keyword)
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self._goto[node].items():
+                queue.append(child)
+                fail = self._fail[node]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                target = self._goto[fail].get(char, 0)
+                self._fail[child] = target if target != child else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+
+    def _iter_hit_ids(self, text):
+        goto, fail, out, keywords = self._goto, self._fail, self._out, self.keywords
+        text_len = len(text)
+        node = 0
+        for pos, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            if not out[node]:
+                continue
+            end = pos + 1
+            if end < text_len and _is_word_char(text[end]) and _is_word_char(char):
+                continue
+            for idx in out[node]:
+                keyword = keywords[idx]
+                start = end - len(keyword)
+                if start > 0 and _is_word_char(text[start - 1]) and _is_word_char(keyword[0]):
+                    continue
+                yield start, end, idx
+
+    def _select(self, hits):
+        hits = sorted(hits, key=lambda hit: (hit[0], hit[0] - hit[1]))
+        if self.overlapping:
+            return hits
+        selected = []
+        last_end = -1
+        for hit in hits:
+            if hit[0] >= last_end:
+                selected.append(hit)
+                last_end = hit[1]
+        return selected
+
+    def iter_hits(self, text):
+        """
+        Scans the text once and yields every keyword occurrence that sits on word boundaries
+        returns: generator of (start, end, keyword) tuples, ordered by end offset
+        """
+        keywords = self.keywords
+        for start, end, idx in self._iter_hit_ids(text):
+            yield start, end, keywords[idx]
+
+    def find(self, text):
+        """
+        Finds keyword hits in the text according to the overlap policy of the matcher
+        returns: list of (start, end, keyword) tuples ordered by start offset
+        """
+        return self._select(self.iter_hits(text))
+
+    def findall(self, text):
+        """
+        Same as find, but returns only the matched keywords
+        returns: list of keywords
+        """
+        return [hit[2] for hit in self.find(text)]
+
+    def findall_ids(self, text):
+        """
+        Same as findall, but returns the positions of the matched keywords in self.keywords
+        returns: list of integers
+        """
+        return [hit[2] for hit in self._select(self._iter_hit_ids(text))]
+
+
+def build_keyword_matcher(kword_col, overlapping=False):
+    """
+    Builds the keyword matcher from a column (or any iterable) of cleaned keywords
+    returns: KeywordMatcher
+    """
+    keywords = kword_col.tolist() if hasattr(kword_col, 'tolist') else list(kword_col)
+    return KeywordMatcher(keywords, overlapping=overlapping)
@@ -0,0 +1,58 @@
+import re
+
+# same word characters as the \b anchor and the KeywordMatcher (str.isalnum() or '_')
+_WORD = re.compile(r'\w+')
+
+
+class KeywordPrefilter:
+    """
+    Cheap test run before the keyword matcher: a keyword hit on word boundaries always starts a word of the text
+    equal to the leading word of the keyword ('lung' for 'lung cancer', 'covid' for 'covid-19'),
+    so a sentence with fewer than two such words cannot hold a pair of keywords and is not matched at all.
+    Keywords which do not start with a word character are counted by substring search instead.
+    The test never rejects a sentence the matcher would find two keywords in.
+    """
+
+    def __init__(self, keywords):
+        self.first_words = set()
+        self.unanchored = []
+        for keyword in dict.fromkeys(keywords):
+            if not isinstance(keyword, str) or not keyword:
+                continue
+            word = _WORD.match(keyword)
+            if word is None:
+                self.unanchored.append(keyword)
+            else:
+                self.first_words.add(word.group())
+
+    def __getstate__(self):
+        return {'first_words': self.first_words, 'unanchored': self.unanchored}
+
+    def __setstate__(self, state):
+        self.first_words = state['first_words']
+        self.unanchored = state['unanchored']
+
+    def candidates(self, text):
+        """
+        Upper bound of the number of keyword hits in the (lowercased) text
+        returns: int
+        """
+        count = sum(map(self.first_words.__contains__, _WORD.findall(text)))
+        for keyword in self.unanchored:
+            count += text.count(keyword)
+        return count
+
+    def may_relate(self, text):
+        """
+        returns: False when the text surely contains fewer than two keyword hits
+        """
+        return self.candidates(text) >= 2
+
+
+def build_keyword_prefilter(kword_col):
+    """
+    Builds the prefilter from a column (or any iterable) of cleaned keywords
+    returns: KeywordPrefilter
+    """
+    keywords = kword_col.tolist() if hasattr(kword_col, 'tolist') else list(kword_col)
+    return KeywordPrefilter(keywords)
@@ -1,56 +1,139 @@
 import pandas as pd
+import numpy as np
 import src.utils.text_preprocessing as pr
-import re
 import itertools
+import time
+from array import array
+import src.utils.metrics as metrics
+from src.utils.keyword_matcher import build_keyword_matcher
+from src.utils.keyword_prefilter import build_keyword_prefilter
 
 
-def get_relations(kword_col, df, conn=None, schema_name=''):
+def get_relations(kword_col, df, conn=None, schema_name='', matcher=None, prefilter=None, read_workers=None,
+                  read_ahead=None):
     """
     Extracts sentences containing at least 2 keywords from the predefined list of keywords.
+    The relations are accumulated in typed columns (keyword ids, ids into a table of the matched sentences)
+    and deduplicated per document, the DataFrame is built from these columns at the end.
+    Sentences which cannot contain two keywords are rejected by the prefilter before the keyword matcher runs.
+    The next documents are read by pr.prefetch_sentences while the current one is scanned.
     Args:
         articles (tuple): A tuple of two elements: a list of article filenames and the directory path where the articles are located.
         keywords (list): A list of keyword pairs to search for in the articles.
+        matcher (KeywordMatcher): A prebuilt matcher for kword_col, built on the fly when not given.
+        prefilter (KeywordPrefilter): A prebuilt prefilter for kword_col, built on the fly when not given,
+            False disables the prefilter.
+        read_workers, read_ahead: Threads reading the documents and the number of documents read ahead,
+            see pr.prefetch_sentences.
     returns: pandas DataFrame containing the paper, 1st_keyword, 2nd_keyword, and sentences where the keyword pairs appear.
     """
     curr = conn.cursor()
-    col_list = set(kword_col.tolist())
-    rows_to_append = []
-    added_pairs = {}
-    # Compile the regular expression pattern
-    pattern = re.compile(r'\b(' + '|'.join(col_list) + r')\b')
-
-    # for paper in articles[0]:
-    for index, row in df.iterrows():
-        # print('processing paper: ', paper)
-        value = row['file_loc']
-        bib_id = int(row['id'])
-        # print('processing paper: ', value)
-        # text = pr.read_files(file=paper, dir_path=articles[1])
+    # Build the keyword automaton once for the whole batch
+    if matcher is None:
+        matcher = build_keyword_matcher(kword_col)
+    keywords = matcher.keywords
+    if prefilter is None:
+        prefilter = build_keyword_prefilter(keywords)
+    num_keywords = len(keywords)
+
+    # one entry per relation
+    first_ids, second_ids, sentence_ids = array('i'), array('i'), array('i')
+    no_of_keywords, doc_ids = array('i'), array('i')
+    # matched sentences and documents referenced by sentence_ids / doc_ids
+    sentences, papers, bib_ids = [], [], []
+
+    start_time = time.perf_counter()
+    read_time = scan_time = 0.0
+    num_sentences = rejected_sentences = rejected_documents = 0
+
+    # only the span found by pr.add_sanitized_spans, when the dataframe has it; the papers it did not find
+    # were reported as missing already
+    if 'text_start' in df.columns:
+        df = df[df['text_start'].notna()]
+        spans = zip(df['text_start'].astype('int64').tolist(), df['text_end'].astype('int64').tolist())
+    else:
+        spans = itertools.repeat((0, None))
+    locations = df['file_loc'].tolist()
+    documents = pr.prefetch_sentences(((value, start, end) for value, (start, end) in zip(locations, spans)),
+                                      workers=read_workers, lookahead=read_ahead)
+
+    read_start = time.perf_counter()
+    for value, bib_id, (text, error) in zip(locations, df['id'].tolist(), documents):
+        bib_id = int(bib_id)
         try:
-            text = pr.read_files(file_location=value)
+            if isinstance(error, FileNotFoundError):
+                pr.report_missing_file(value)
+                continue
+            if error is not None:
+                raise error
+            metrics.inc('documents')
+            doc_id = len(papers)
+            papers.append(value)
+            bib_ids.append(bib_id)
+            # sentence -> its id in sentences, the relations are deduplicated within the document only
+            doc_sentences = {}
+            added_pairs = set()
+            doc_rejected = True
             for sentence in text:
+                scan_start = time.perf_counter()
+                read_time += scan_start - read_start
+                num_sentences += 1
                 sentence_lower = sentence.lower()
-                patterns = pattern.findall(sentence_lower)
-                matches = [keyword[0] for keyword in patterns if keyword[0] in col_list]
+                if prefilter and not prefilter.may_relate(sentence_lower):
+                    rejected_sentences += 1
+                    scan_time += time.perf_counter() - scan_start
+                    read_start = time.perf_counter()
+                    continue
+                doc_rejected = False
+                matches = matcher.findall_ids(sentence_lower)
+                scan_time += time.perf_counter() - scan_start
                 if len(matches) >= 2:
-                    # If there are at least two matches, save all combinations of two keywords to the dataframe
-                    for combo in itertools.combinations(matches, 2):
-                        # Sort the pair of keywords to avoid duplicates and convert to tuple
-                        pair = tuple(sorted(combo))
-                        # Check if the same combination has already been added to the dataframe with the same sentence
-                        if pair in added_pairs and sentence in added_pairs[pair]:
+                    sentence_id = doc_sentences.get(sentence)
+                    if sentence_id is None:
+                        sentence_id = doc_sentences[sentence] = len(sentences)
+                        sentences.append(sentence)
+                    # If there are at least two matches, save all combinations of two keywords
+                    for first, second in itertools.combinations(matches, 2):
+                        # Sort the pair of keywords to avoid duplicates
+                        if keywords[first] > keywords[second]:
+                            first, second = second, first
+                        # Skip the same combination already found in the same sentence, encoded as one integer
+                        key = ((first * num_keywords + second) << 32) | sentence_id
+                        if key in added_pairs:
                             continue
-                        if pair not in added_pairs:
-                            added_pairs[pair] = set()
-                        added_pairs[pair].add(sentence)
-                        # Append the row to the dataframe
-                        rows_to_append.append(
-                            {'paper': value, '1st_keyword': pair[0], '2nd_keyword': pair[1], 'sentences': sentence,
-                            'no_of_keywords': len(matches), 'bib_id': bib_id})
+                        added_pairs.add(key)
+                        first_ids.append(first)
+                        second_ids.append(second)
+                        sentence_ids.append(sentence_id)
+                        no_of_keywords.append(len(matches))
+                        doc_ids.append(doc_id)
+                read_start = time.perf_counter()
+            # the matcher did not run on any sentence of the document
+            rejected_documents += doc_rejected
         except Exception as e:
             print(f"Error was detected: {e}")
             curr.execute('ROLLBACK')
             continue
-    df = pd.DataFrame(rows_to_append, columns=['paper', '1st_keyword', '2nd_keyword', 'sentences', 'no_of_keywords', 'bib_id'])
+        finally:
+            # time spent waiting for the prefetched document counts as reading
+            read_start = time.perf_counter()
+
+    keywords = np.asarray(keywords, dtype=object)
+    doc_ids = np.array(doc_ids, dtype=np.int32)
+    df = pd.DataFrame({'paper': np.asarray(papers, dtype=object)[doc_ids],
+                       '1st_keyword': keywords[np.array(first_ids, dtype=np.int32)],
+                       '2nd_keyword': keywords[np.array(second_ids, dtype=np.int32)],
+                       'sentences': np.asarray(sentences, dtype=object)[np.array(sentence_ids, dtype=np.int32)],
+                       'no_of_keywords': np.array(no_of_keywords, dtype=np.int32),
+                       'bib_id': np.asarray(bib_ids, dtype=np.int64)[doc_ids]},
+                      columns=['paper', '1st_keyword', '2nd_keyword', 'sentences', 'no_of_keywords', 'bib_id'])
+    metrics.inc('sentences', num_sentences)
+    if prefilter:
+        metrics.inc('prefilter_rejected_sentences', rejected_sentences)
+        metrics.inc('prefilter_rejected_documents', rejected_documents)
+    metrics.inc('pairs', len(df))
+    metrics.observe('file_read', read_time)
+    metrics.observe('keyword_scan', scan_time)
+    metrics.observe('get_relations', time.perf_counter() - start_time)
 
     return df
@@ -0,0 +1,219 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+PREFIX = 'relations_'
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+
+
+class Registry:
+    """
+    Counters and timing histograms. Snapshots are plain dicts, so the metrics of joblib workers
+    can be returned with their results and merged into the registry of the main process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        # name -> [count, sum, bucket counts...]
+        self.timers = {}
+
+    def inc(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, seconds):
+        with self._lock:
+            timer = self.timers.get(name)
+            if timer is None:
+                timer = self.timers[name] = [0, 0.0] + [0] * len(BUCKETS)
+            timer[0] += 1
+            timer[1] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    timer[2 + i] += 1
+
+    def seconds(self, name):
+        timer = self.timers.get(name)
+        return timer[1] if timer else 0.0
+
+    def snapshot(self):
+        with self._lock:
+            return {'counters': dict(self.counters), 'timers': {k: list(v) for k, v in self.timers.items()}}
+
+    def merge(self, snapshot):
+        with self._lock:
+            for name, value in snapshot['counters'].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, values in snapshot['timers'].items():
+                timer = self.timers.get(name)
+                if timer is None:
+                    self.timers[name] = list(values)
+                else:
+                    self.timers[name] = [a + b for a, b in zip(timer, values)]
+
+
+class Utilization:
+    """
+    Busy time of every worker of a pool, compared with the wall time elapsed since the tracker was created
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.busy = {}
+
+    def add(self, worker, seconds):
+        with self._lock:
+            self.busy[worker] = self.busy.get(worker, 0.0) + seconds
+
+    def report(self, workers=None):
+        """
+        Share of the wall time every worker spent on work and the mean over the pool
+        (workers is the size of the pool, idle workers which never got work count as 0)
+        returns: dict
+        """
+        wall = time.perf_counter() - self.started
+        with self._lock:
+            shares = {str(worker): round(busy / wall, 3) if wall else None for worker, busy in self.busy.items()}
+            total = sum(self.busy.values())
+        workers = max(workers or len(shares), 1)
+        return {'wall_seconds': round(wall, 3), 'workers': shares,
+                'mean': round(total / (wall * workers), 3) if wall else None}
+
+
+_registry = Registry()
+_local = threading.local()
+
+
+def _targets():
+    scoped = getattr(_local, 'scopes', None)
+    return [_registry] + (scoped or [])
+
+
+def inc(name, value=1):
+    """
+    Increments a counter in the process registry and in the open scopes of the current thread
+    """
+    for registry in _targets():
+        registry.inc(name, value)
+
+
+def observe(name, seconds):
+    """
+    Records a duration in the process registry and in the open scopes of the current thread
+    """
+    for registry in _targets():
+        registry.observe(name, seconds)
+
+
+@contextmanager
+def timer(name):
+    """
+    Context manager timing its block under the given name
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start)
+
+
+def timed(name):
+    """
+    Decorator timing every call of the function under the given name
+    """
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def scope():
+    """
+    Collects the metrics recorded by the current thread inside the block into a separate registry,
+    used to get per-batch numbers while the process registry keeps the totals
+    returns: Registry
+    """
+    registry = Registry()
+    if not hasattr(_local, 'scopes'):
+        _local.scopes = []
+    _local.scopes.append(registry)
+    try:
+        yield registry
+    finally:
+        _local.scopes.remove(registry)
+
+
+def registry():
+    """
+    returns: the Registry of the current process
+    """
+    return _registry
+
+
+def batch_rates(batch):
+    """
+    Throughput of one batch from its registry and the share of sentences rejected by the keyword prefilter
+    returns: dict of rates per second
+    """
+    def rate(counter, timer_name):
+        seconds = batch.seconds(timer_name)
+        return round(batch.counters.get(counter, 0) / seconds, 1) if seconds else None
+
+    sentences = batch.counters.get('sentences', 0)
+    rejected = batch.counters.get('prefilter_rejected_sentences')
+    return {'docs_per_s': rate('documents', 'preprocessing'),
+            'sentences_per_s': rate('sentences', 'preprocessing'),
+            'pairs_per_s': rate('pairs', 'preprocessing'),
+            'inference_rows_per_s': rate('inference_rows', 'inference'),
+            'insert_rows_per_s': rate('inserted_rows', 'insertion'),
+            'prefilter_rejection_rate': round(rejected / sentences, 3) if rejected is not None and sentences else None}
+
+
+def to_prometheus(reg=None):
+    """
+    Renders the registry in the Prometheus text exposition format
+    returns: str
+    """
+    snapshot = (reg or _registry).snapshot()
+    lines = []
+    for name, value in sorted(snapshot['counters'].items()):
+        lines.append(f'# TYPE {PREFIX}{name}_total counter')
+        lines.append(f'{PREFIX}{name}_total {value}')
+    for name, values in sorted(snapshot['timers'].items()):
+        metric = f'{PREFIX}{name}_seconds'
+        lines.append(f'# TYPE {metric} histogram')
+        for bound, count in zip(BUCKETS, values[2:]):
+            lines.append(f'{metric}_bucket{{le="{bound}"}} {count}')
+        lines.append(f'{metric}_bucket{{le="+Inf"}} {values[0]}')
+        lines.append(f'{metric}_sum {values[1]}')
+        lines.append(f'{metric}_count {values[0]}')
+    return '\n'.join(lines) + '\n'
+
+
+def write_prometheus_textfile(path, reg=None):
+    """
+    Writes the registry atomically to a file for the node exporter textfile collector
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    with os.fdopen(fd, 'w') as f:
+        f.write(to_prometheus(reg))
+    os.replace(tmp_path, path)
+
+
+def log_json(path, record):
+    """
+    Appends one JSON record (line) to the metrics log
+    """
+    with open(path, 'a') as f:
+        f.write(json.dumps(record) + '\n')
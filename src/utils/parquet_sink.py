@@ -0,0 +1,217 @@
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import src.utils.metrics as metrics
+from src.utils.hashing import sentence_digest
+
+# rows buffered per partition before they are written as one row group
+ROW_GROUP_SIZE = 128 * 1024
+# rows of a segment: all the files of the sink are closed (and readable) once this many rows were written to them
+SEGMENT_ROWS = 4 * 1024 * 1024
+DICTIONARY_COLUMNS = ['keyword1', 'keyword2', 'category']
+# keys of the sentences written most recently which the sink remembers (about 150 bytes each)
+KEY_CACHE_SIZE = 1_000_000
+
+
+def _strings(values):
+    # str() of every value, missing values (None, NaN) become nulls
+    values = pd.Series(values)
+    return [None if missing else str(value) for value, missing in zip(values.tolist(), values.isna().tolist())]
+
+
+def _open_path(path):
+    # hidden name of a file while it is written
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f'.{name}.tmp')
+
+
+def _partition_value(value):
+    try:
+        return str(int(value))
+    except (TypeError, ValueError):
+        return '__HIVE_DEFAULT_PARTITION__'
+
+
+class ParquetSink:
+    """
+    Streaming columnar sink of the results, usable instead of or alongside insert_data / insert_data_bulk.
+    The relationships and sentences of every batch are buffered and appended as row groups of about row_group_size
+    rows to Parquet files: root/relationships/year=<year>/part-*.parquet and root/sentences/part-*.parquet.
+    Keyword and category columns are dictionary encoded, missing values are nulls. Relationships reference sentences
+    by sentence_key, the 128 bit sentence_digest of the text. The sink remembers the key_cache_size keys it wrote
+    most recently (PARQUET_KEY_CACHE_SIZE, starting with the keys of the newest sentences files already in root) and
+    does not write those sentences again: a sentence not seen for longer may be written once more, with the same
+    key and text, so the sentences are deduplicated by sentence_key when they are read.
+    A Parquet file is readable only once it is closed, so the files are written in segments: after segment_rows rows
+    (and on close) all the open files are closed and on_commit is called with the document ids they hold.
+    Open files have hidden names (.part-*.parquet.tmp) and are renamed when closed, so readers never see them and
+    a crash leaves no broken files in the dataset.
+    pyarrow is imported when the sink is created. The sink can be shared by several threads.
+    """
+
+    def __init__(self, root, row_group_size=ROW_GROUP_SIZE, segment_rows=SEGMENT_ROWS, partition_by='year',
+                 compression='zstd', on_commit=None, key_cache_size=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa, self._pq = pa, pq
+        self.root = root
+        self.row_group_size = row_group_size
+        self.segment_rows = segment_rows
+        self.partition_by = partition_by
+        self.compression = compression
+        self.on_commit = on_commit
+        self._lock = threading.Lock()
+        # (table, partition) -> [buffered arrow tables, buffered rows], (table, partition) -> (ParquetWriter, path)
+        self._buffers = {}
+        self._writers = {}
+        self._segment_rows = 0
+        self._segment_documents = []
+        # least recently written sentence keys first
+        self._written_keys = OrderedDict()
+        self.key_cache_size = int(os.getenv('PARQUET_KEY_CACHE_SIZE', KEY_CACHE_SIZE)) \
+            if key_cache_size is None else key_cache_size
+        self._schemas = {
+            'relationships': pa.schema([('document_id', pa.int64()), ('sentence_key', pa.binary(16))] +
+                                       [(col, pa.dictionary(pa.int32(), pa.string())) for col in DICTIONARY_COLUMNS]),
+            'sentences': pa.schema([('sentence_key', pa.binary(16)), ('sentences', pa.string()),
+                                    ('document_id', pa.int64())]),
+        }
+        self._load_written_keys()
+
+    def _load_written_keys(self):
+        # keys of the newest sentences files written by earlier runs (or other processes) to the same root,
+        # read until the cache is full
+        directory = os.path.join(self.root, 'sentences')
+        if not os.path.isdir(directory) or self.key_cache_size <= 0:
+            return
+        paths = [os.path.join(directory, name) for name in os.listdir(directory)
+                 if name.startswith('part-') and name.endswith('.parquet')]
+        keys = []
+        for path in sorted(paths, key=os.path.getmtime, reverse=True):
+            keys.append(self._pq.read_table(path, columns=['sentence_key']).column('sentence_key').to_pylist())
+            if sum(map(len, keys)) >= self.key_cache_size:
+                break
+        # oldest files first, so the newest keys are the most recently used ones
+        for file_keys in reversed(keys):
+            self._remember(file_keys)
+
+    def _remember(self, keys):
+        for key in keys:
+            self._written_keys[key] = None
+            self._written_keys.move_to_end(key)
+        while len(self._written_keys) > self.key_cache_size:
+            self._written_keys.popitem(last=False)
+
+    def _tables(self, df):
+        """
+        returns: list of (('relationships', partition), table), table of the distinct sentences of the batch
+        """
+        pa = self._pa
+        # every distinct sentence of the batch is hashed once
+        codes, sentences = pd.factorize(df['sentences'], use_na_sentinel=False)
+        keys = pa.array([sentence_digest(sentence) for sentence in sentences], type=pa.binary(16))
+        document_ids = df['bib_id'].to_numpy(dtype='int64')
+        relationships = {
+            'document_id': pa.array(document_ids),
+            'sentence_key': keys.take(pa.array(codes)),
+            'keyword1': pa.array(_strings(df['1st_keyword']), type=pa.string()).dictionary_encode(),
+            'keyword2': pa.array(_strings(df['2nd_keyword']), type=pa.string()).dictionary_encode(),
+            'category': pa.array(_strings(df['category']), type=pa.string()).dictionary_encode(),
+        }
+        # one table per partition of the relationships
+        table = pa.table(relationships, schema=self._schemas['relationships'])
+        if self.partition_by and self.partition_by in df.columns:
+            partition_codes, values = pd.factorize(df[self.partition_by], use_na_sentinel=False)
+            tables = [(('relationships', f'{self.partition_by}={_partition_value(value)}'),
+                       table.filter(pa.array(partition_codes == code)))
+                      for code, value in sorted(enumerate(values), key=lambda item: _partition_value(item[1]))]
+        else:
+            tables = [(('relationships', None), table)]
+
+        # first row of every distinct sentence
+        first = np.full(len(sentences), len(codes), dtype=np.int64)
+        np.minimum.at(first, codes, np.arange(len(codes)))
+        return tables, pa.table({
+            'sentence_key': keys,
+            'sentences': pa.array(_strings(sentences), type=pa.string()),
+            'document_id': pa.array(document_ids[first]),
+        }, schema=self._schemas['sentences'])
+
+    def _writer(self, key):
+        if key not in self._writers:
+            name, partition = key
+            directory = os.path.join(self.root, name, *([partition] if partition else []))
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f'part-{os.getpid()}-{uuid.uuid4().hex[:12]}.parquet')
+            writer = self._pq.ParquetWriter(_open_path(path), self._schemas[name], compression=self.compression,
+                                            use_dictionary=DICTIONARY_COLUMNS if name == 'relationships' else False)
+            self._writers[key] = (writer, path)
+        return self._writers[key][0]
+
+    def _flush(self, key):
+        tables, rows = self._buffers.pop(key, ([], 0))
+        if rows:
+            self._writer(key).write_table(self._pa.concat_tables(tables), row_group_size=self.row_group_size)
+
+    def _close_segment(self):
+        for key in list(self._buffers):
+            self._flush(key)
+        for writer, path in self._writers.values():
+            writer.close()
+            os.replace(_open_path(path), path)
+        self._writers = {}
+        document_ids, self._segment_documents = self._segment_documents, []
+        self._segment_rows = 0
+        if self.on_commit is not None and document_ids:
+            self.on_commit(document_ids)
+
+    def _append(self, key, table):
+        buffer = self._buffers.setdefault(key, [[], 0])
+        buffer[0].append(table)
+        buffer[1] += table.num_rows
+        if buffer[1] >= self.row_group_size:
+            self._flush(key)
+
+    def write(self, df, document_ids=None):
+        """
+        Appends the relationships and the sentences not written yet of a batch. Row groups are written once
+        row_group_size rows of a partition are buffered, so small batches do not make small row groups.
+        returns: number of written relationships
+        """
+        start = time.perf_counter()
+        tables, sentences = self._tables(df)
+        with self._lock:
+            for key, table in tables:
+                self._append(key, table)
+            keys = sentences.column('sentence_key').to_pylist()
+            new = [key not in self._written_keys for key in keys]
+            self._remember(keys)
+            if any(new):
+                self._append(('sentences', None), sentences.filter(self._pa.array(new)))
+            self._segment_documents.extend(document_ids if document_ids is not None else [])
+            self._segment_rows += len(df)
+            if self._segment_rows >= self.segment_rows:
+                self._close_segment()
+        metrics.observe('parquet_write', time.perf_counter() - start)
+        metrics.inc('parquet_rows', len(df))
+        return len(df)
+
+    def close(self):
+        """
+        Writes the buffered rows and closes the files
+        """
+        with self._lock:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
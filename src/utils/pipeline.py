@@ -0,0 +1,105 @@
+import queue
+import threading
+
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of the pipeline: func is applied to every item coming from the previous stage by `workers` threads,
+    the result (unless None) is passed to the next stage. CPU heavy stages should hand the work to a process pool
+    from func, the thread then only waits for the result.
+    """
+
+    def __init__(self, name, func, workers=1):
+        self.name = name
+        self.func = func
+        self.workers = workers
+
+
+def _put(q, item, stop):
+    # blocking put which gives up once the pipeline is being stopped
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(q, stop):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+def run_pipeline(source, stages, queue_size=2):
+    """
+    Runs the stages concurrently, connected by bounded queues, so batch N+1 is processed by the first stage
+    while batch N is in the second stage and so on. A full queue blocks the upstream stage (backpressure),
+    so at most queue_size items wait between two stages.
+    The first exception raised by any stage stops the pipeline and is re-raised here.
+    returns: number of items which went through all the stages
+    """
+    stop = threading.Event()
+    errors = []
+    queues = [queue.Queue(maxsize=queue_size) for _ in stages]
+    finished = {'items': 0}
+    lock = threading.Lock()
+
+    def feed():
+        try:
+            for item in source:
+                if not _put(queues[0], item, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            _put(queues[0], _DONE, stop)
+
+    def work(index, stage, remaining):
+        in_q = queues[index]
+        out_q = queues[index + 1] if index + 1 < len(queues) else None
+        try:
+            while True:
+                item = _get(in_q, stop)
+                if item is _DONE:
+                    # let the sibling workers of this stage see the end as well
+                    _put(in_q, _DONE, stop)
+                    break
+                result = stage.func(item)
+                if out_q is None:
+                    with lock:
+                        finished['items'] += 1
+                elif result is not None:
+                    if not _put(out_q, result, stop):
+                        break
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and out_q is not None:
+                _put(out_q, _DONE, stop)
+
+    threads = [threading.Thread(target=feed, name='pipeline-source', daemon=True)]
+    for index, stage in enumerate(stages):
+        remaining = [stage.workers]
+        threads.extend(threading.Thread(target=work, args=(index, stage, remaining),
+                                        name=f'pipeline-{stage.name}-{n}', daemon=True)
+                       for n in range(stage.workers))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return finished['items']
@@ -1,6 +1,13 @@
 import pandas as pd
 import bibtexparser
 import os
+import numpy as np
+
+SWAPPED_COLUMNS = {'1st_keyword': '2nd_keyword', '2nd_keyword': '1st_keyword',
+                   'normalized_term_x': 'normalized_term_y', 'normalized_term_y': 'normalized_term_x',
+                   'general_term_x': 'general_term_y', 'general_term_y': 'general_term_x',
+                   'displayed_term_x': 'displayed_term_y', 'displayed_term_y': 'displayed_term_x'}
+MERGE_KEYS = ['paper', 'normalized_term_x', 'normalized_term_y', 'displayed_term_x', 'displayed_term_y']
 
 
 def bibtex2pandas(bib_path, bib_cols):
@@ -26,20 +33,9 @@ def swap_and_add(df):
     returns: pandas.DataFrame
     The combined dataframe with all the rows duplicated and the first and second columns swapped.
     """
-    df2 = df.copy()
-    df2['1st_keyword'] = df['2nd_keyword']
-    df2['2nd_keyword'] = df['1st_keyword']
-
-    df2['normalized_term_x'] = df['normalized_term_y']
-    df2['normalized_term_y'] = df['normalized_term_x']
-
-    df2['general_term_x'] = df['general_term_y']
-    df2['general_term_y'] = df['general_term_x']
-
-    df2['displayed_term_x'] = df['displayed_term_y']
-    df2['displayed_term_y'] = df['displayed_term_x']
-
-    df = df.append(df2, ignore_index=True)
+    # the swapped copy is the same frame with the x/y column labels exchanged, pd.concat aligns it by label
+    df2 = df.rename(columns=SWAPPED_COLUMNS)
+    df = pd.concat([df, df2[df.columns]], ignore_index=True)
     return df
 
 
@@ -51,20 +47,47 @@ def join_non_none(x):
     return ';; '.join(non_none_values)
 
 
+def _group_chunks(codes, values, num_groups, by_length=False):
+    """
+    Unique values of every group in the order of their first appearance (longest first when by_length),
+    the frame is deduplicated and sorted once and then split at the group boundaries
+    returns: list of lists, one per group code
+    """
+    frame = pd.DataFrame({'group': codes, 'value': values}).drop_duplicates()
+    if by_length:
+        frame['length'] = -frame['value'].str.len()
+        frame = frame.sort_values(['group', 'length'], kind='stable')
+    else:
+        frame = frame.sort_values('group', kind='stable')
+    ends = np.cumsum(np.bincount(frame['group'].to_numpy(), minlength=num_groups)).tolist()
+    values = frame['value'].to_numpy(dtype=object).tolist()
+    return [values[start:end] for start, end in zip([0] + ends[:-1], ends)]
+
+
 def merge_abbreviations(df, cols):
     """
    Merges the abbreviations found in the '1st_keyword' and '2nd_keyword' columns of a pandas DataFrame `df`,
    grouping and aggregating the data by the columns 'paper', 'Normalized_term_x' and 'Normalized_term_y'.
+   The groups are numbered once and every aggregated column is built with vectorized operations,
+   instead of calling a python function per group and column.
    returns: a new pandas DataFrame with the merged abbreviations and the grouped and aggregated data.
    """
-    df_agg = df[cols].groupby(
-        ['paper', 'normalized_term_x', 'normalized_term_y', 'displayed_term_x', 'displayed_term_y', ],
-        as_index=False).agg({'1st_keyword': lambda x: ', '.join(sorted(set(x), key=len, reverse=True)),
-                             '2nd_keyword': lambda x: ', '.join(sorted(set(x), key=len, reverse=True)),
-                             'sentences': lambda x: (x.unique().tolist()),
-                             'category': lambda x: (x.unique().tolist()),
-                             'general_term_x': lambda x: (x.unique().tolist()),
-                             'general_term_y': lambda x: (x.unique().tolist())})
+    df = df[cols].dropna(subset=MERGE_KEYS)
+    groups = df.groupby(MERGE_KEYS, sort=True)
+    codes = groups.ngroup().to_numpy()
+    num_groups = groups.ngroups
+    if not num_groups:
+        return pd.DataFrame(columns=MERGE_KEYS + ['1st_keyword', '2nd_keyword', 'sentences', 'category',
+                                                  'general_term_x', 'general_term_y'])
+
+    # first row of every group, in the sorted order of the group keys
+    first_rows = np.full(num_groups, len(df), dtype=np.int64)
+    np.minimum.at(first_rows, codes, np.arange(len(df)))
+    df_agg = df[MERGE_KEYS].iloc[first_rows].reset_index(drop=True)
+    for col in ['1st_keyword', '2nd_keyword']:
+        df_agg[col] = [', '.join(chunk) for chunk in _group_chunks(codes, df[col], num_groups, by_length=True)]
+    for col in ['sentences', 'category', 'general_term_x', 'general_term_y']:
+        df_agg[col] = _group_chunks(codes, df[col], num_groups)
     return df_agg
 
 
@@ -1,6 +1,9 @@
+import numpy as np
 import pandas as pd
 import regex as re
 
+TERM_COLS = ['normalized_term', 'general_term', 'displayed_term']
+
 
 def adding_norm_terms(df, df_kwords):
     """
@@ -14,6 +17,58 @@ def adding_norm_terms(df, df_kwords):
     return df_paper
 
 
+class KeywordIndex:
+    """
+    Keyword table coded as integers: keyword name -> row position -> category code of every term column.
+    Built once per keyword table, it replaces the string merges of adding_norm_terms by array lookups.
+    """
+
+    def __init__(self, df_kwords, key='name', cols=None):
+        self.cols = TERM_COLS if cols is None else cols
+        self.names = pd.Index(df_kwords[key])
+        self.codes = {}
+        self.categories = {}
+        for col in self.cols:
+            categorical = pd.Categorical(df_kwords[col])
+            # position -1 (unknown keyword) takes the trailing code -1, missing like a missing term
+            self.codes[col] = np.append(categorical.codes.astype(np.int32), np.int32(-1))
+            self.categories[col] = categorical.categories
+
+    def positions(self, keywords):
+        """
+        returns: row positions of the keywords in the keyword table, -1 for unknown ones
+        """
+        # a batch repeats a few thousand keywords, only the distinct ones are looked up
+        codes, distinct = pd.factorize(keywords, use_na_sentinel=False)
+        return self.names.get_indexer(distinct).take(codes)
+
+
+def adding_norm_terms_indexed(df, keyword_index, drop_self_relations=True):
+    """
+    Same columns as adding_norm_terms (<term>_x for the 1st keyword, <term>_y for the 2nd one) computed with
+    integer lookups in a KeywordIndex. With drop_self_relations the pairs of two keywords with the same
+    normalized term are dropped first. The term columns are categoricals sharing the categories of the keyword
+    table, no string is copied per row.
+    returns: pandas.DataFrame
+    """
+    pos_x = keyword_index.positions(df['1st_keyword'])
+    pos_y = keyword_index.positions(df['2nd_keyword'])
+    if drop_self_relations:
+        norm_codes = keyword_index.codes['normalized_term']
+        norm_x, norm_y = norm_codes.take(pos_x), norm_codes.take(pos_y)
+        # missing terms never compare equal, like NaN != NaN in the string filter
+        keep = (norm_x != norm_y) | (norm_x < 0)
+        df = df[keep]
+        pos_x, pos_y = pos_x[keep], pos_y[keep]
+    df = df.copy()
+    for col in keyword_index.cols:
+        codes = keyword_index.codes[col]
+        categories = keyword_index.categories[col]
+        df[f'{col}_x'] = pd.Categorical.from_codes(codes.take(pos_x), categories)
+        df[f'{col}_y'] = pd.Categorical.from_codes(codes.take(pos_y), categories)
+    return df
+
+
 def extract_author_kws(df, input_col, output_col):
     """
     Extracting sentences containing keywords mentioned by author
@@ -1,4 +1,26 @@
+import codecs
+import hashlib
+import io
+import json
 import os
+import sqlite3
+import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import src.utils.metrics as metrics
+
+READ_CHUNK_SIZE = 1 << 20
+# documents read by the prefetching reader at once, and how far ahead of the consumer it reads
+READ_WORKERS = 4
+# bytes of the documents read ahead of the consumer at most (each is held as bytes, text and sentences for a while)
+READ_AHEAD_BYTES = 32 << 20
+# larger parts of files are not read ahead in one piece, they are streamed when their turn comes
+PREFETCH_MAX_BYTES = 4 << 20
+MISSING_FILES_LOG = "missing_txt_files.txt"
+
+_span_caches = {}
+
 
 def read_files(file_location):
     """
@@ -7,19 +29,146 @@ def read_files(file_location):
     return: content of the file
     """
     try:
-        with open(fr"{file_location}", encoding="utf8", errors='ignore') as f:
-            all_sentences = f.read()
-            # split based on empty lines
-            paragraphs = all_sentences.split('\n\n')
-            all_sentences_list = []
-            for paragraph in paragraphs:
-                # split each paragraph based on dots
-                sentences = paragraph.replace('\n', ' ').split('.')
-                # append the resulting sentences to the list
-                all_sentences_list.extend(sentences)
-            return all_sentences_list
+        return list(iter_sentences(file_location))
     except FileNotFoundError:
-        print(f"File {file_location} not found. Skipping...")
+        report_missing_file(file_location)
+
+
+def report_missing_file(file_location):
+    """
+    Single place where a missing paper is reported (and counted in the metrics)
+    """
+    print(f"File {file_location} not found. Skipping...")
+    metrics.inc('missing_files')
+
+
+def _write_missing_files(missing_files):
+    if missing_files:
+        with open(MISSING_FILES_LOG, "w") as missing_file:
+            missing_file.write("\n".join(missing_files))
+
+
+def _text_decoder():
+    # decodes bytes like a text mode open(): utf-8 ignoring errors, universal newlines
+    return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder('utf-8')(errors='ignore'), translate=True)
+
+
+def _iter_text_chunks(file_location, chunk_size, start, end):
+    # decoded bytes [start, end) of the file
+    decoder = _text_decoder()
+    with open(fr"{file_location}", 'rb') as f:
+        f.seek(start)
+        remaining = end - start if end is not None else None
+        while remaining is None or remaining > 0:
+            data = f.read(chunk_size if remaining is None else min(chunk_size, remaining))
+            if not data:
+                break
+            if remaining is not None:
+                remaining -= len(data)
+            yield decoder.decode(data)
+    yield decoder.decode(b'', final=True)
+
+
+def iter_sentences(file_location, chunk_size=READ_CHUNK_SIZE, start=0, end=None):
+    """
+    Stream sentences from a file without loading it whole
+    The file is read in fixed-size chunks, the unfinished paragraph/sentence is carried over to the next chunk,
+    so the output is the same as for read_files (paragraphs split on empty lines, sentences split on dots)
+    while the memory stays bounded by the chunk size and the longest sentence.
+    start and end (byte offsets, see sanitized_span) restrict the reading to a part of the file.
+    return: generator of sentences
+    """
+    return _split_sentences(_iter_text_chunks(file_location, chunk_size, start, end))
+
+
+def _split_sentences(chunks):
+    # paragraphs split on empty lines, sentences split on dots, across the boundaries of the chunks
+    carry = ''
+    for chunk in chunks:
+        if not chunk:
+            continue
+        buffer = carry + chunk
+        # hold a trailing newline back, it can be the first half of an empty line
+        cut = len(buffer) - 1 if buffer.endswith('\n') else len(buffer)
+        paragraphs = buffer[:cut].split('\n\n')
+        tail = paragraphs.pop()
+        for paragraph in paragraphs:
+            yield from paragraph.replace('\n', ' ').split('.')
+        dot = tail.rfind('.')
+        if dot != -1:
+            yield from tail[:dot].replace('\n', ' ').split('.')
+            tail = tail[dot + 1:]
+        carry = tail + buffer[cut:]
+    for paragraph in carry.split('\n\n'):
+        yield from paragraph.replace('\n', ' ').split('.')
+
+
+def load_sentences(file_location, start=0, end=None, max_bytes=PREFETCH_MAX_BYTES):
+    """
+    Reads the part [start, end) of a file in one go and splits it like iter_sentences,
+    a part larger than max_bytes is left to be streamed by iter_sentences instead
+    return: list (or generator) of sentences, raises FileNotFoundError for missing files
+    """
+    size = os.stat(file_location).st_size
+    end = size if end is None else min(end, size)
+    if end - start > max_bytes:
+        return iter_sentences(file_location, start=start, end=end)
+    with open(fr"{file_location}", 'rb') as f:
+        f.seek(start)
+        data = f.read(max(end - start, 0))
+    return list(_split_sentences([_text_decoder().decode(data, final=True)]))
+
+
+def _load_document(document):
+    try:
+        return load_sentences(*document), None
+    except Exception as e:
+        return None, e
+
+
+def _prefetch_bytes(document, max_bytes=PREFETCH_MAX_BYTES):
+    # bytes a document holds while it is read ahead, streamed (and missing) documents hold nothing until consumed
+    file_location, start, end = document
+    try:
+        size = (end if end is not None else os.stat(file_location).st_size) - start
+    except OSError:
+        return 0
+    return size if size <= max_bytes else 0
+
+
+def prefetch_sentences(documents, workers=None, lookahead=None, lookahead_bytes=None):
+    """
+    Reads the documents on a thread pool while the caller processes the current one, so the disk (or network mount)
+    and the CPU work at the same time. At most lookahead documents of at most lookahead_bytes in total are read
+    ahead of the consumer (one document is always read ahead), parts of files above PREFETCH_MAX_BYTES are streamed.
+    workers, lookahead and lookahead_bytes default to the READ_WORKERS, READ_AHEAD and READ_AHEAD_BYTES environment
+    variables (4, 2 * workers and 32 MiB).
+    documents: iterable of (file_location, start, end), start and end as for iter_sentences (end None = whole file)
+    return: generator of (sentences, error) in the order of documents, error is the exception (FileNotFoundError
+    for a missing file) raised while reading the document, sentences is None then
+    """
+    workers = workers or int(os.getenv('READ_WORKERS') or READ_WORKERS)
+    lookahead = max(lookahead or int(os.getenv('READ_AHEAD') or 2 * workers), 1)
+    lookahead_bytes = lookahead_bytes or int(os.getenv('READ_AHEAD_BYTES') or READ_AHEAD_BYTES)
+    documents = iter(documents)
+    document = next(documents, None)
+    # (future, bytes) of the documents read ahead
+    pending, held = deque(), 0
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch') as pool:
+        while True:
+            while document is not None and len(pending) < lookahead:
+                size = _prefetch_bytes(document)
+                if pending and held + size > lookahead_bytes:
+                    break
+                pending.append((pool.submit(_load_document, document), size))
+                held += size
+                document = next(documents, None)
+            if not pending:
+                return
+            future, size = pending.popleft()
+            result = future.result()
+            held -= size
+            yield result
 
 
 def get_directory_content(dir_path):
@@ -46,11 +195,13 @@ def remove_text(df, stopwords_before, stopwords_after):
     """
     missing_files = set()
     for index, value in df['file_location'].items():
-        if not os.path.exists(value):
+        try:
+            file = open(value, 'r+', encoding="latin-1")
+        except FileNotFoundError:
             missing_files.add(value)
-            print('couldnt find path:', value)
+            report_missing_file(value)
             continue
-        with open(value, 'r+', encoding="latin-1") as file:
+        with file:
             # print('Removing unnecessary parts from:', value)
             text = file.read()
             for stopword in stopwords_before:
@@ -66,8 +217,128 @@ def remove_text(df, stopwords_before, stopwords_after):
             file.seek(0)  # move file pointer to the beginning of the file
             file.write(text)
             file.truncate()  # truncate the file to the length of the new content
-    if missing_files:
-        with open("missing_txt_files.txt", "w") as missing_file:
-            missing_file.write("\n".join(missing_files))
+    _write_missing_files(missing_files)
+
+
+def _stopword_offsets(file, stopwords, chunk_size=READ_CHUNK_SIZE):
+    """
+    Offsets of every occurrence of the stopwords, the file is read chunk by chunk: the last len(stopword) - 1
+    characters of a chunk are kept, so the occurrences across chunk boundaries are found as well
+    returns: dict stopword -> sorted offsets, length of the text
+    """
+    offsets = {stopword: [] for stopword in stopwords}
+    keep = max(map(len, offsets), default=1) - 1
+    tail, tail_offset = '', 0
+    while True:
+        chunk = file.read(chunk_size)
+        if not chunk:
+            break
+        text = tail + chunk
+        for stopword, found in offsets.items():
+            index = text.find(stopword)
+            while index != -1:
+                # an occurrence within the kept tail was found in the previous chunk
+                if index + len(stopword) > len(tail):
+                    found.append(tail_offset + index)
+                index = text.find(stopword, index + 1)
+        tail = text[max(len(text) - keep, 0):] if keep else ''
+        tail_offset += len(text) - len(tail)
+    return offsets, tail_offset + len(tail)
+
+
+def _find_span(file, stopwords_before, stopwords_after, chunk_size=READ_CHUNK_SIZE):
+    # same trimming as remove_text, expressed as offsets into the untouched text, in bounded memory
+    offsets, length = _stopword_offsets(file, list(stopwords_before) + list(stopwords_after), chunk_size)
+    start, end = 0, length
+    for stopword in stopwords_before:
+        # text.find(stopword, start, end)
+        stop_index = next((index for index in offsets[stopword] if index >= start and index + len(stopword) <= end),
+                          None)
+        if stop_index is None:
+            continue
+        start = stop_index + len(stopword)
+    for stopword in stopwords_after:
+        stop_index = next((index for index in offsets[stopword] if index >= start and index + len(stopword) <= end),
+                          None)
+        if stop_index is None:
+            continue
+        end = stop_index
+    return start, end
+
 
+def _span_cache(cache_path):
+    conn = _span_caches.get((os.getpid(), cache_path))
+    if conn is None:
+        conn = sqlite3.connect(cache_path, timeout=60, check_same_thread=False)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute("""CREATE TABLE IF NOT EXISTS spans (
+            path TEXT,
+            mtime_ns INTEGER,
+            size INTEGER,
+            config TEXT,
+            text_start INTEGER,
+            text_end INTEGER,
+            PRIMARY KEY (path, mtime_ns, size, config)
+        )""")
+        conn.commit()
+        _span_caches[(os.getpid(), cache_path)] = conn
+    return conn
 
+
+def span_cache_path():
+    """
+    returns: SQLite file of the sanitized span cache, SANITIZED_SPAN_CACHE or <tmp>/sanitized_spans.sqlite
+    """
+    return os.getenv('SANITIZED_SPAN_CACHE') or os.path.join(tempfile.gettempdir(), 'sanitized_spans.sqlite')
+
+
+def sanitized_span(file_location, stopwords_before, stopwords_after, cache_path=None):
+    """
+    Finds the part of a paper between the stopwords without rewriting the file (see remove_text).
+    With cache_path the span is stored in an SQLite cache keyed by the path, modification time, size and
+    the stopwords, so for an unchanged paper only a stat call is needed on later runs. The paper is scanned
+    chunk by chunk, it is never held in memory as a whole.
+    The file is decoded as latin-1, so the returned character offsets are byte offsets for iter_sentences.
+    return: (start, end) byte offsets, raises FileNotFoundError for missing files
+    """
+    stat = os.stat(file_location)
+    config = hashlib.sha1(json.dumps([stopwords_before, stopwords_after]).encode()).hexdigest()
+    key = (os.path.abspath(file_location), stat.st_mtime_ns, stat.st_size, config)
+    if cache_path:
+        conn = _span_cache(cache_path)
+        row = conn.execute('SELECT text_start, text_end FROM spans WHERE path = ? AND mtime_ns = ? AND size = ? '
+                           'AND config = ?', key).fetchone()
+        if row is not None:
+            return row
+
+    with open(file_location, 'r', encoding="latin-1", newline='') as file:
+        span = _find_span(file, stopwords_before, stopwords_after)
+
+    if cache_path:
+        conn.execute('INSERT OR REPLACE INTO spans VALUES (?, ?, ?, ?, ?, ?)', key + span)
+        conn.commit()
+    return span
+
+
+def add_sanitized_spans(df, stopwords_before, stopwords_after, cache_path=None, input_col='file_loc'):
+    """
+    Non-destructive replacement of remove_text: adds the 'text_start' and 'text_end' byte offsets of the
+    relevant part of every paper to the dataframe, the papers on the disk stay untouched.
+    Missing papers get no span and are listed in missing_txt_files.txt.
+    return: pandas dataframe
+    """
+    missing_files = set()
+    starts, ends = [], []
+    for value in df[input_col]:
+        try:
+            start, end = sanitized_span(value, stopwords_before, stopwords_after, cache_path=cache_path)
+        except FileNotFoundError:
+            missing_files.add(value)
+            report_missing_file(value)
+            start, end = None, None
+        starts.append(start)
+        ends.append(end)
+    df['text_start'] = starts
+    df['text_end'] = ends
+    _write_missing_files(missing_files)
+    return df